@@ -1,60 +1,67 @@
 """
-Script opens transitions and saves transition time data as xr.dataarrays.
+Script reads the transition catalogue and saves transition time data as xr.dataarrays.
 """
 cluster=True
+import numpy as np
 import xarray as xr
 import sys
 import os
+import glob
 if cluster:
     sys.path.append('/rds/general/user/cfn18/home/Double-Well-SR/Finding-Transitions/')
 else:
     sys.path.append('/Users/cfn18/Desktop/Double-Well-SR/Finding-Transitions/')
-from utilities import transition_dir, alpha_eps_pairs
+from utilities import transition_parent_dir, transition_catalogue
 
 ################################################################################
 ## Specify Parameters
 ################################################################################
-if __name__ == "__main__":
-    cluster=True
-    alphas = [0., 0.25, 0.5, 1.]
-    epsilons = [10., 1., 0.1, 0.01, 0.001]
-    ae_pairs = alpha_eps_pairs(alphas, epsilons)
-    alpha, eps = ae_pairs[int(sys.argv[1]) - 1]
-
 c2h=True #looking at cold to hot or reverse?
 
 ################################################################################
-## Functions for opening transitions
-################################################################################
-
-def nc_test(file):
-    return file[-3:] == '.nc'
-
-def transition_file_list(alpha, eps, c2h=True, cluster=False):
-    c2h_obs_dir, h2c_obs_dir = transition_dir(alpha, eps, cluster=cluster)
-
-    if c2h:
-        obs_dir = c2h_obs_dir
-    else:
-        obs_dir = h2c_obs_dir
-
-    obs_files=[]
-    for file in os.listdir(obs_dir):
-        if nc_test(file):
-            obs_files.append(obs_dir + file)
-    return obs_files
-
-################################################################################
-## Function for getting transition time
+## Functions for the transition catalogue
 ################################################################################
 
-def get_transition_times(file_list):
-    transition_times = []
-    for file in file_list:
-        ds = xr.open_dataset(file)
-        transition_times.append((ds.time.max() - ds.time.min()).item())
-        ds.close()
-    return transition_times
+def load_transition_catalogue(cluster=False):
+    """
+    Loads every catalogue.nc written when transitions were found, as one dataset
+    with a 'transition' dimension and alpha, sigma, direction, start_time,
+    duration, waiting_time and source_file columns.
+    Returns an empty catalogue if none have been written yet.
+    """
+    files = sorted(glob.glob(transition_parent_dir(cluster) + '*/*/catalogue.nc'))
+    if len(files) == 0:
+        print(f'No catalogues found under {transition_parent_dir(cluster)}')
+        return transition_catalogue(xr.Dataset(coords={'time': [0.]}), np.zeros((0, 3), dtype=int))
+    catalogues = []
+    for file in files:
+        with xr.open_dataset(file) as ds:
+            catalogues.append(ds.load())
+    return xr.concat(catalogues, dim='transition')
+
+def catalogue_cases(catalogue):
+    "Unique (alpha, sigma) pairs with transitions in the catalogue."
+    return sorted(set(zip(catalogue.alpha.values.tolist(), catalogue.sigma.values.tolist())))
+
+def select_transitions(catalogue, alpha, sigma, c2h=True):
+    "Rows of the catalogue for one (alpha, sigma, direction)."
+    direction = 'c2h' if c2h else 'h2c'
+    mask = (catalogue.alpha == alpha) & (catalogue.sigma == sigma) & (catalogue.direction == direction)
+    return catalogue.isel(transition=mask.values)
+
+def catalogue_transition_times(catalogue, alpha, sigma, c2h=True):
+    "Same as get_transition_times but read from the catalogue."
+    return select_transitions(catalogue, alpha, sigma, c2h).duration.values
+
+def catalogue_rate(catalogue, alpha, sigma, c2h=True):
+    """
+    Transition rate estimated as one over the mean waiting time.
+    nan if there are no matching transitions or the mean waiting time is 0.
+    """
+    waiting_time = select_transitions(catalogue, alpha, sigma, c2h).waiting_time.values
+    if len(waiting_time) == 0 or waiting_time.mean() == 0:
+        return np.nan
+    return 1 / waiting_time.mean()
 
 ################################################################################
 ## Function for saving transition times
@@ -72,16 +79,16 @@ def ensure_directory_exists(d):
         os.makedirs(d)
         print(f'Made directory at {d}')
 
-def save_transition_time_data(data, alpha, eps, save_dir, c2h):
+def save_transition_time_data(data, alpha, sigma, save_dir, c2h):
     "Save transition time data as a data array."
-    da = xr.DataArray(transition_times, name='Transtion_Time', attrs={'alpha':alpha, 'epsilon':eps})
+    da = xr.DataArray(data, name='Transtion_Time', attrs={'alpha':alpha, 'sigma':sigma})
 
     if c2h:
         save_dir += 'c2h/'
     else:
         save_dir += 'h2c/'
 
-    save_name = f'alpha{alpha}_eps{eps}'.replace('.', '_') + '.nc'
+    save_name = f'alpha{alpha}_sigma{sigma}'.replace('.', '_') + '.nc'
 
     ensure_directory_exists(save_dir)
     da.to_netcdf(save_dir + save_name)
@@ -92,7 +99,8 @@ def save_transition_time_data(data, alpha, eps, save_dir, c2h):
 ## Actually Calculating the transition times and then saving results
 ################################################################################
 if __name__ == "__main__":
-    transition_files = transition_file_list(alpha, eps, c2h=c2h, cluster=cluster)
-    transition_times = get_transition_times(transition_files)
+    catalogue = load_transition_catalogue(cluster) # One read for the whole sweep
     save_dir = parent_tt_dir(cluster) + 'transition-time-data/'
-    save_transition_time_data(transition_times, alpha, eps, save_dir, c2h)
+    for alpha, sigma in catalogue_cases(catalogue): # Every case transitions were found for
+        transition_times = catalogue_transition_times(catalogue, alpha, sigma, c2h=c2h)
+        save_transition_time_data(transition_times, alpha, sigma, save_dir, c2h)
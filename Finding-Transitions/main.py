@@ -1,10 +1,20 @@
 """
 This script takes a load of stochastic integrations from the rotated double well
 and identifies the transitions in them.
+
+Run with a PBS array index to do a single (alpha, sigma) case, or with no
+arguments to sweep over every case on the local machine.
 """
 from utilities import *
 import sys
 
+# Importing Double Well
+from pathlib import Path
+sys.path.append(str(Path.home()/'python_utilities'))
+from import_helper import *
+add_double_well_dir()
+from path_density import PathDensity
+
 ################################################################################
 ## Specify parameters
 ################################################################################
@@ -22,22 +32,52 @@ cluster = True
 ## Finding Transitions and saving
 ################################################################################
 
-# Choose alpha, eps from array jobs
-alpha, sigma = as_pairs[int(sys.argv[1]) - 1]
-
-# Initialise list of transitions for fixed alpha, sigma pair
-c2h_transitions = []
-h2c_transtions = []
-
-# Loop through hot/cold ensemble files and find transitions
-integration_files = xr_files(alpha, sigma)
-for file in integration_files:
-    ds = xr.open_dataset(file)
-    c2h, h2c = get_transitions(ds, ball_size)
-    c2h_transitions += c2h # add transitions to long list
-    h2c_transtions += h2c
-
-# Save Transitions for given alpha, eps
-c2h_save_dir, h2c_save_dir = transition_dir(alpha, sigma, cluster)
-save_list(c2h_transitions, c2h_save_dir)
-save_list(c2h_transitions, h2c_save_dir)
+def run_case(alpha, sigma):
+    "Find and save the transitions for a fixed alpha, sigma pair."
+
+    # Initialise list of transitions for fixed alpha, sigma pair
+    c2h_transitions = []
+    h2c_transitions = []
+    c2h_sources = []
+    h2c_sources = []
+    catalogues = []
+    attrs = {'alpha': alpha, 'sigma': sigma, 'ball_size': ball_size}
+    c2h_density = PathDensity(attrs=attrs)
+    h2c_density = PathDensity(attrs=attrs)
+
+    # Loop through hot/cold ensemble files and find transitions
+    integration_files = xr_files(alpha, sigma)
+    for file in integration_files:
+        ds = xr.open_dataset(file)
+        c2h, h2c, catalogue = get_transitions_and_catalogue(ds, ball_size, file)
+        catalogues.append(catalogue)
+        c2h_transitions += [t.load() for t in c2h] # add transitions to long list
+        h2c_transitions += [t.load() for t in h2c]
+        c2h_sources += [file] * len(c2h)
+        h2c_sources += [file] * len(h2c)
+        for t in c2h:
+            c2h_density.update_ds(t)
+        for t in h2c:
+            h2c_density.update_ds(t)
+        ds.close()
+
+    # Save Transitions for given alpha, eps, one file per direction
+    c2h_save_name, h2c_save_name = transition_store_name(alpha, sigma, cluster)
+    save_transition_store(c2h_transitions, c2h_save_name, c2h_sources, attrs)
+    save_transition_store(h2c_transitions, h2c_save_name, h2c_sources, attrs)
+    c2h_density_name, h2c_density_name = path_density_name(alpha, sigma, cluster)
+    c2h_density.save(c2h_density_name)
+    h2c_density.save(h2c_density_name)
+    save_transition_catalogue(catalogues, transition_catalogue_name(alpha, sigma, cluster))
+
+def is_complete(alpha, sigma):
+    "The catalogue is written last, so its existence means the case finished."
+    return os.path.exists(transition_catalogue_name(alpha, sigma, cluster))
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1: # Choose alpha, eps from array jobs
+        alpha, sigma = as_pairs[int(sys.argv[1]) - 1]
+        run_case(alpha, sigma)
+    else: # Sweep all cases over the cores of this machine
+        from sweep import run_sweep
+        run_sweep(run_case, as_pairs, is_complete, cost=lambda a, s: len(xr_files(a, s)))
@@ -6,9 +6,14 @@ import os
 import xarray as xr
 import numpy as np
 import sys
+from pathlib import Path
 from tqdm import tqdm
 import glob
 
+sys.path.append(str(Path(__file__).resolve().parents[1])) # Double-Well-SR
+from sweep import alpha_sigma_pairs
+from path_density import PathDensity
+
 ################################################################################
 ## Functions for finding transitions
 ################################################################################
@@ -30,55 +35,84 @@ def symbolic_ts(ts, ball_size=0.1):
     hot_points = _tag_hot_points(ts, ball_size)
     return cold_points + hot_points
 
-def cold_to_hot_transitions(ts, ball_size=0.1):
-    " Take a single timeseries and return transitions from cold to hot point."
-    c2h = [] # List of transitions
-    symbolic_path = symbolic_ts(ts, ball_size)
+def transition_intervals(symbolic_path):
+    """
+    Single pass over a symbolic path finding every transition.
+    Returns an (n, 3) int array of (start, end, direction) rows where
+    symbolic_path[start:end] is of the form (-1, 0, ..., 0, 1) for direction 1
+    (cold to hot) or (1, 0, ..., 0, -1) for direction -1 (hot to cold).
+    """
+    tagged = np.flatnonzero(symbolic_path)
+    values = symbolic_path[tagged]
+
+    # A transition is a pair of consecutive tagged points in different balls
+    change = values[1:] != values[:-1]
+    starts = tagged[:-1][change]
+    ends = tagged[1:][change] + 1
+    directions = values[1:][change]
+    return np.column_stack((starts, ends, directions)).astype(int)
 
-    # Identifying sequences of the form (-1, 0, ..., 0, 1)
-    for i in np.where(symbolic_path == -1)[0]:
-        next_hot_point = np.argmax(symbolic_path[i:])
+def _select_transitions(ts, intervals, direction):
+    return [ts.isel(time=slice(i, j)) for i, j, d in intervals if d == direction]
 
-        # Is it only 0's between the -1 and 1?
-        if (np.sum(symbolic_path[slice(i, i + next_hot_point + 1)]) == 0):
-            transition = ts.isel(time=slice(i, i + next_hot_point + 1))
-            c2h.append(transition)
-    return c2h
+def cold_to_hot_transitions(ts, ball_size=0.1):
+    " Take a single timeseries and return transitions from cold to hot point."
+    intervals = transition_intervals(symbolic_ts(ts, ball_size))
+    return _select_transitions(ts, intervals, 1)
 
 def hot_to_cold_transitions(ts, ball_size=0.1):
     " Take a single timeseries and return transitions from hot to cold point."
-    h2c = [] # List of transitions
-    symbolic_path = symbolic_ts(ts, ball_size)
-
-    # Identifying sequences of the form (1, 0, ..., 0, -1)
-    for i in np.where(symbolic_path == 1)[0]:
-        next_cold_point = np.argmin(symbolic_path[i:])
-
-        # Is it only 0's between the 1 and -1?
-        if (np.sum(symbolic_path[slice(i, i + next_cold_point + 1)]) == 0):
-            transition = ts.isel(time=slice(i, i + next_cold_point + 1))
-            h2c.append(transition)
-    return h2c
+    intervals = transition_intervals(symbolic_ts(ts, ball_size))
+    return _select_transitions(ts, intervals, -1)
 
 def get_transitions(ds, ball_size=0.1):
     "Gets transitions both ways for a given dataset"
-    c2h = []
-    h2c = []
-    c2h += cold_to_hot_transitions(ds, ball_size)
-    h2c += hot_to_cold_transitions(ds, ball_size)
+    intervals = transition_intervals(symbolic_ts(ds, ball_size))
+    c2h = _select_transitions(ds, intervals, 1)
+    h2c = _select_transitions(ds, intervals, -1)
     return c2h, h2c
 
+def transition_catalogue(ds, intervals, source_file=''):
+    """
+    Columnar summary of the transitions found in one timeseries.
+    Waiting time is measured from the end of the previous transition, or the
+    start of the timeseries, to the start of each transition.
+    """
+    time = ds.time.values
+    starts, ends, directions = np.asarray(intervals, dtype=int).reshape(-1, 3).T
+    return catalogue_from_times(ds.attrs.get('alpha', np.nan), ds.attrs.get('sigma', np.nan),
+                                np.where(directions == 1, 'c2h', 'h2c'), time[starts], time[ends - 1],
+                                time[0], source_file)
+
+def catalogue_from_times(alpha, sigma, directions, start_time, end_time, t0=0., source_file=''):
+    """
+    As transition_catalogue, from the direction ('c2h' or 'h2c'), start and
+    end time of each transition in a timeseries starting at t0.
+    """
+    start_time = np.asarray(start_time, dtype=float)
+    end_time = np.asarray(end_time, dtype=float)
+    previous_end = np.append(t0, end_time[:-1])
+    n = len(start_time)
+    return xr.Dataset({
+        'alpha': ('transition', np.full(n, alpha, dtype=float)),
+        'sigma': ('transition', np.full(n, sigma, dtype=float)),
+        'direction': ('transition', np.asarray(directions, dtype=str).reshape(n)),
+        'start_time': ('transition', start_time),
+        'duration': ('transition', end_time - start_time),
+        'waiting_time': ('transition', start_time - previous_end),
+        'source_file': ('transition', np.full(n, source_file, dtype=object).astype(str)),
+        })
+
+def get_transitions_and_catalogue(ds, ball_size=0.1, source_file=''):
+    "As get_transitions, also returning the transition_catalogue of ds."
+    intervals = transition_intervals(symbolic_ts(ds, ball_size))
+    c2h = _select_transitions(ds, intervals, 1)
+    h2c = _select_transitions(ds, intervals, -1)
+    return c2h, h2c, transition_catalogue(ds, intervals, source_file)
+
 ################################################################################
 ## Functions for loading integration files
 ################################################################################
-def alpha_sigma_pairs(alphas, sigmas):
-    "List (a, e) pairs for lists of alphas and epsilons."
-    alpha_sigma_pairs = []
-    for alpha in alphas:
-        for sigma in sigmas:
-            alpha_sigma_pairs.append((alpha, sigma))
-    return alpha_sigma_pairs
-
 def integration_directory(alpha, sigma):
     return f'/rds/general/user/cfn18/ephemeral/Rotated-2D-Well-Stochastic-Model/alpha_{alpha}/sigma_{sigma}/cold_ic/'.replace('.', '_')
 
@@ -96,20 +130,158 @@ def transition_parent_dir(cluster=False):
     else:
         return '/Users/cfn18/Desktop/Double-Well-SR/Finding-Transitions/Test-Data/Test-Transition-Data/'
 
-def transition_dir(alpha, sigma, cluster=False):
-    "For fixed alpha, sigma returns save directory."
-    p_dir = transition_parent_dir(cluster)
+def case_dir(alpha, sigma, cluster=False):
+    "For fixed alpha, sigma returns the directory its transition files live in."
     alpha_sub_dir = f'alpha_{alpha}/'.replace('.', '_')
     sigma_sub_dir = f'sigma_{sigma}/'.replace('.', '_')
-    transition_directory = p_dir + alpha_sub_dir + sigma_sub_dir
+    return transition_parent_dir(cluster) + alpha_sub_dir + sigma_sub_dir
 
-    directories = [transition_directory + x for x in ['cold-to-hot/', 'hot-to-cold/']]
+def _ensure_directories(directories):
     for d in directories:
         if not os.path.exists(d):
             os.makedirs(d)
             print(f'Made directory at {d}')
+
+def transition_dir(alpha, sigma, cluster=False):
+    "For fixed alpha, sigma returns save directory."
+    directories = [case_dir(alpha, sigma, cluster) + x for x in ['cold-to-hot/', 'hot-to-cold/']]
+    _ensure_directories(directories)
     return directories
 
+def transition_store_name(alpha, sigma, cluster=False):
+    "For fixed alpha, sigma returns consolidated store files (c2h, h2c)."
+    transition_directory = case_dir(alpha, sigma, cluster)
+    _ensure_directories([transition_directory])
+    return [transition_directory + x for x in ['cold-to-hot.nc', 'hot-to-cold.nc']]
+
+def transition_catalogue_name(alpha, sigma, cluster=False):
+    "For fixed alpha, sigma returns the transition catalogue file."
+    return case_dir(alpha, sigma, cluster) + 'catalogue.nc'
+
+def save_transition_catalogue(catalogues, save_name):
+    "Concatenate per file catalogues and save."
+    if len(catalogues) == 0:
+        catalogue = transition_catalogue(xr.Dataset(coords={'time': [0.]}), np.zeros((0, 3), dtype=int))
+    else:
+        catalogue = xr.concat(catalogues, dim='transition')
+    catalogue.to_netcdf(save_name)
+    print(f'Saved catalogue of {len(catalogue.transition)} transitions at {save_name}')
+
+def path_density_name(alpha, sigma, cluster=False):
+    "For fixed alpha, sigma returns path density files (c2h, h2c)."
+    transition_directory = case_dir(alpha, sigma, cluster)
+    return [transition_directory + x for x in ['cold-to-hot-density.nc', 'hot-to-cold-density.nc']]
+
+def save_transition_store(ds_list, save_name, source_files=None, attrs=None):
+    """
+    Save a list of transitions as a single ragged netCDF file.
+    Samples are concatenated along 'sample', transition i being
+    sample offset[i]:offset[i] + length[i], with per transition metadata.
+    source_files: file each transition came from, same length as ds_list.
+    """
+    if source_files is None:
+        source_files = [''] * len(ds_list)
+    lengths = np.array([len(ds.time) for ds in ds_list], dtype=int)
+    offsets = np.cumsum(lengths) - lengths
+    start_times = np.array([ds.time.values[0] for ds in ds_list], dtype=float)
+    end_times = np.array([ds.time.values[-1] for ds in ds_list], dtype=float)
+
+    def concat(name):
+        if len(ds_list) == 0:
+            return np.array([], dtype=float)
+        return np.concatenate([ds[name].values for ds in ds_list])
+
+    store = xr.Dataset({
+        'x': ('sample', concat('x')),
+        'y': ('sample', concat('y')),
+        'time': ('sample', concat('time')),
+        'offset': ('transition', offsets),
+        'length': ('transition', lengths),
+        'start_time': ('transition', start_times),
+        'duration': ('transition', end_times - start_times),
+        'source_file': ('transition', np.array(source_files, dtype=str)),
+        }, attrs={} if attrs is None else attrs)
+    store.to_netcdf(save_name)
+    print(f'Saved {len(ds_list)} transitions at {save_name}')
+
+class TransitionStore:
+    """
+    Read access to a file written by save_transition_store.
+    The file is read once, transitions are then handed out as views.
+    """
+
+    def __init__(self, file_location):
+        self.file_location = file_location
+        with xr.open_dataset(file_location) as ds:
+            self.ds = ds.load()
+        self.attrs = self.ds.attrs
+        self._x = self.ds.x.values
+        self._y = self.ds.y.values
+        self._time = self.ds.time.values
+        self._offset = self.ds.offset.values
+        self._length = self.ds.length.values
+
+    def __len__(self):
+        return len(self._offset)
+
+    def __getitem__(self, i):
+        "Transition i as an xr.Dataset in the same form as get_transitions."
+        s = slice(self._offset[i], self._offset[i] + self._length[i])
+        time = self._time[s]
+        x = xr.DataArray(self._x[s], coords={'time': time}, dims=['time'], name='x')
+        y = xr.DataArray(self._y[s], coords={'time': time}, dims=['time'], name='y')
+        return xr.Dataset({'x': x, 'y': y}, attrs=self.attrs)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def metadata(self):
+        "Per transition start time, duration and source file."
+        return self.ds[['offset', 'length', 'start_time', 'duration', 'source_file']]
+
+    @property
+    def samples(self):
+        "All transition points concatenated, as (x, y)."
+        return self._x, self._y
+
+def consolidate_transitions(save_dir, prefixes):
+    """
+    Merge the per integration files save_em_transitions wrote in save_dir
+    with each prefix into cold-to-hot.nc, hot-to-cold.nc, catalogue.nc and,
+    if written, the path densities, the layout main.py writes.
+    The per integration files are removed once merged.
+    """
+    merged = []
+    for name in ['cold-to-hot', 'hot-to-cold']:
+        transitions, sources, attrs = [], [], None
+        for prefix in prefixes:
+            store = TransitionStore(save_dir + prefix + name + '.nc')
+            transitions += list(store)
+            sources += list(store.metadata.source_file.values)
+            attrs = store.attrs
+            merged.append(save_dir + prefix + name + '.nc')
+        save_transition_store(transitions, save_dir + name + '.nc', sources, attrs)
+
+        densities = [save_dir + prefix + name + '-density.nc' for prefix in prefixes]
+        densities = [f for f in densities if os.path.exists(f)]
+        if len(densities) > 0:
+            density = PathDensity.load(densities[0])
+            for f in densities[1:]:
+                density.merge(PathDensity.load(f))
+            density.save(save_dir + name + '-density.nc')
+            merged += densities
+
+    catalogues = []
+    for prefix in prefixes:
+        with xr.open_dataset(save_dir + prefix + 'catalogue.nc') as ds:
+            catalogues.append(ds.load())
+        merged.append(save_dir + prefix + 'catalogue.nc')
+    save_transition_catalogue(catalogues, save_dir + 'catalogue.nc')
+    for f in merged:
+        os.remove(f)
+
 def save_list(ds_list, save_dir):
     "Save ds list in specified directory."
     for i, ds in enumerate(ds_list):
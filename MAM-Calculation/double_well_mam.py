@@ -8,66 +8,26 @@ Example run of MAM for the 2D Double Well.
 """
 
 # Standard Dependencies
-import sys
 import os
+import pickle
+import queue
+import threading
 import time as tm
+import numpy as np
 import xarray as xr
 
 ###################################################
 ## Importing MAM Code
 ###################################################
-mam_code_location = '/Users/cfn18/Documents/PhD-Work/Third-Year/Instanton-Work/Action-Minimisation-Algorithm/'
-sys.path.append(mam_code_location)
-from fw_action import *
-from mam import *
-
-###################################################
-## Double Model Defintion
-###################################################
-
-# Drift
-double_well_file = '/Users/cfn18/Documents/PhD-Work/Third-Year/Instanton-Work/Double-Well-SR/'
-sys.path.append(double_well_file)
-from deterministic_double_well import jax_warped_well
-drift = jax_warped_well
-
-# Diffusion Definition
-import jax.numpy as jnp
-def diff_inv(x, s):
-    return jnp.eye(2, 2)
-
-###################################################
-## Example Run
-###################################################
-
-if __name__ == '__main__':
-
-    # Where Results Saved
-    sd = '/Users/cfn18/Desktop/Double-Well-Test/'
-
-    # Warping parameter
-    alpha = 0.5
-
-    # Time over which instanton is parameterised
-    steps = 500
-    dt = 0.1
-    time = np.arange(0, dt * steps, dt)
-
-    # Initial Instanton
-    initial_point = [1, 0]
-    final_point = [0, 0]
-    inst_ic  = np.linspace(initial_point, final_point, steps)
-
-    # Run Model
-    run_additive_mam_double_well(1, inst_ic, time, sd, bounds=None,
-                                 block_len=5, number_of_blocks=10, instanton_snapshot_blocks=[0, 1, 2, 3, 4, 5])
+from double_well_action import DoubleWellMam, GeometricDoubleWellMam
 
 ###################################################
 ## Function for Running MAM in the double Well
 ###################################################
 
 def run_additive_mam_double_well(alpha, inst_ic, time, save_location, bounds=None,
-                                 block_len=100, number_of_blocks=10, instanton_snapshot_blocks=[0]):
+                                 block_len=100, number_of_blocks=10, instanton_snapshot_blocks=[0],
+                                 geometric=False, n_points=50):
     """
     Minimises the FW action for the L96-EBM Model with additive noise.
 
@@ -93,59 +53,63 @@ def run_additive_mam_double_well(alpha, inst_ic, time, save_location, bounds=Non
         How many blocks of minimisation to run.
         Total number of minimisation iterations will be: block_len * number_of_blocks.
 
+    geometric, bool
+        If True minimise the geometric action on an arc length parametrised
+        path of n_points nodes instead. time is then not used.
+
     """
 
     ##########################################
     ## Setting Up MAM Objects
     ##########################################
-    print('\n*** Setting up jfw object. *** \n')
-    # Object for calculating the FW Action and it's jacobian
-    p = np.array([alpha, 1])
-    fw = JFW(drift, diff_inv) # Freidlin-Wentzell object
-
-    # Minimisation object
+    # Minimisation object, FW action and its gradient are built in
     print('\n*** Setting up MAM object. *** \n')
-    mamjax = MamJax(fw, inst_ic, time, p) # MAM algorithm object
+    p = np.array([alpha, 1])
+    if geometric:
+        mamjax = GeometricDoubleWellMam(inst_ic, p, n_points)
+    else:
+        mamjax = DoubleWellMam(inst_ic, time, p) # MAM algorithm object
 
     if bounds is not None:
         mamjax.bnds=bounds
 
     # Observer object
     print('\n*** Setting up MAM observer. *** \n')
-    observer = doubleWellMAMO(mamjax, save_location)
-    # mamjax.run({'maxiter': 0, 'maxfun': 0}) # initialise result object to be observed
-    # mamjax.nit = 0
-    observer.save_instanton_ic()
-    # observer.save_instanton_snapshot()
-    # observer.save_av()
-    # observer.save_status()
-
-    ##########################################
-    ## Running and Saving in Blocks
-    ##########################################
-
-    # Runnning MAM
-    opt={'maxiter': block_len, 'maxfun': 10 * block_len}
-
-    print('\n*** Starting MAM *** \n')
-
-    for i in range(number_of_blocks):
-
-        print(f'\nRunning block {i+1}/{number_of_blocks}\n')
-        mamjax.run(opt)
-        observer.save_av() # Status/AV saved after each block
-        observer.save_status()
-        observer.save_instanton()
-        if i+1 in instanton_snapshot_blocks:
-            observer.save_instanton_snapshot()
-
-        # Check if you've converged
-        if (mamjax.res.success is True):
-            print('Success, quitting MAM and saving result.')
-            break
-
-        else:
-            print('No convergence thus far. Will continue minimisation.\n')
+    # Closing the observer waits for queued writes, also if MAM fails or is interrupted
+    with doubleWellMAMO(mamjax, save_location) as observer:
+        # mamjax.run({'maxiter': 0, 'maxfun': 0}) # initialise result object to be observed
+        # mamjax.nit = 0
+        observer.save_instanton_ic()
+        # observer.save_instanton_snapshot()
+        # observer.save_av()
+        # observer.save_status()
+
+        ##########################################
+        ## Running and Saving in Blocks
+        ##########################################
+
+        # Runnning MAM
+        opt={'maxiter': block_len, 'maxfun': 10 * block_len}
+
+        print('\n*** Starting MAM *** \n')
+
+        for i in range(number_of_blocks):
+
+            print(f'\nRunning block {i+1}/{number_of_blocks}\n')
+            mamjax.run(opt)
+            observer.save_av() # Status/AV saved after each block
+            observer.save_status()
+            observer.save_instanton()
+            if i+1 in instanton_snapshot_blocks:
+                observer.save_instanton_snapshot()
+
+            # Check if you've converged
+            if (mamjax.res.success is True):
+                print('Success, quitting MAM and saving result.')
+                break
+
+            else:
+                print('No convergence thus far. Will continue minimisation.\n')
     return
 
 ###################################################
@@ -158,15 +122,22 @@ class doubleWellMAMO:
 
     - Currently observes: instanton, action value, status and parameters.
     - Initialised with a MAMJAX object and a save location.
+    - Writing happens on a background thread fed by a bounded queue, so the
+      minimisation only waits on the filesystem if the queue is full.
 
     Methods
     -----------
     save_parameters()
         Runs when initialised, saves parameters in pickled dictionary.
 
-    snaphot()
-        To be called after each bout of minimisation.
-        Saves action value, instanton and status in save_loc directory.
+    save_av(), save_status()
+        Append a line to action_log.csv/status_log.txt.
+
+    save_instanton(), save_instanton_snapshot(), save_instanton_ic()
+        Queue a copy of the current instanton to be written to netCDF.
+
+    close()
+        Waits for queued writes to finish and stops the writer.
 
     Attributes
     -----------
@@ -174,12 +145,12 @@ class doubleWellMAMO:
         Object used to rune the MAM algorithm with jax.
         Imagine this would work with a mam object, haven't tried.
 
-    save_loc: string
+    pd: string
         Directory where the observations saved.
 
     """
 
-    def __init__(self, mj, pd):
+    def __init__(self, mj, pd, max_queue=10):
         """
         Parameters
         ----------
@@ -190,6 +161,9 @@ class doubleWellMAMO:
         pd: string
             Directory where the observations saved.
 
+        max_queue: int
+            Most writes waiting at once before save calls block.
+
         """
         self.mj = mj
         self.pd = pd
@@ -202,6 +176,26 @@ class doubleWellMAMO:
         self.av_list = []
         self.starting_cpu_time = tm.time()
 
+        # Append-only logs
+        self.action_log = self.pd + '/action_log.csv'
+        self.status_log = self.pd + '/status_log.txt'
+        for log, header in [(self.action_log, 'iteration,action\n'),
+                            (self.status_log, 'iteration\trunning_time\tsuccess\tmessage\n')]:
+            if not os.path.exists(log):
+                with open(log, 'w') as file:
+                    file.write(header)
+
+        # Background writer
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
     @property
     def parameters(self):
         "Parameters used for a run. Access by instanton"
@@ -214,6 +208,60 @@ class doubleWellMAMO:
         }
         return param
 
+    ##########################################
+    ## Background Writing
+    ##########################################
+
+    def _write_loop(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                job[0](*job[1:])
+            except Exception as e: # Keep writing later observations
+                print(f'Failed to save observation: {e!r}')
+            finally:
+                self.queue.task_done()
+
+    def _submit(self, *job):
+        "Queue a write, blocks only when max_queue writes are already waiting."
+        self.queue.put(job)
+
+    def flush(self):
+        "Wait until everything queued so far is written."
+        self.queue.join()
+
+    def close(self):
+        if self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join()
+
+    @staticmethod
+    def _append(file_name, line):
+        with open(file_name, 'a') as file:
+            file.write(line)
+
+    @staticmethod
+    def _write_instanton(instanton, time, parameters, file_name):
+        "Build and save the instanton dataset, via a temporary file so readers never see half a file."
+        dic = {}
+        dic['X'] = xr.DataArray(instanton[:, 0], dims=['time'], name='X', coords = {'time': time})
+        dic['Y'] = xr.DataArray(instanton[:, 1], dims=['time'], name='Y', coords = {'time': time})
+        ds = xr.Dataset(dic, attrs=parameters)
+        ds.to_netcdf(file_name + '.tmp')
+        os.replace(file_name + '.tmp', file_name)
+        print('\nInstanton saved at ' + file_name)
+
+    def _submit_instanton(self, file_name):
+        # Copies, the minimiser carries on changing the instanton
+        self._submit(self._write_instanton, self.mj.instanton.copy(), np.array(self.mj.time),
+                     self.parameters, file_name)
+
+    ##########################################
+    ## Observations
+    ##########################################
+
     def save_parameters(self):
         with open(self.pd +'/parameters.pickle','wb') as file:
             pickle.dump(self.parameters, file)
@@ -223,79 +271,60 @@ class doubleWellMAMO:
 
         # Save as (nit, av) pairs
         nit = self.mj.nit
-        av = self.mj.res.fun
+        av = float(self.mj.res.fun)
         self.av_list.append((nit, av))
-
-        # Pickle av_list
-        with open(self.pd + '/action_timeseries.pickle','wb') as file:
-            pickle.dump(self.av_list, file)
-            print(f'\nAction values saved at {self.pd}/av.pickle\n')
+        self._submit(self._append, self.action_log, f'{nit},{av!r}\n')
 
     def save_status(self):
 
         # Info we want
         success = self.mj.res.success
-        message = self.mj.res.message
+        message = str(self.mj.res.message).replace('\n', ' ')
         nit = self.mj.nit
         cpu_time = tm.time() - self.starting_cpu_time
 
-        # Write to text file
-        f = open(self.pd + "/current_status.txt", "w")
-        f.write(f'{nit} iterations completed\nRunning Time(s):{cpu_time}\nSuccess: {success}\n{message}\n')
+        self._submit(self._append, self.status_log, f'{nit}\t{cpu_time}\t{success}\t{message}\n')
         print(f'Converged: {success}')
-        f.close()
 
     def save_instanton_snapshot(self):
         "Saves instanton snapshot."
+        self._submit_instanton(self.instanton_dir + f'/iteration_{self.mj.nit}.nc')
 
-        # Put Instanton in xr form
-        dic = {}
-        _time = self.mj.time
-        _X = self.mj.instanton[:, 0]
-        _Y = self.mj.instanton[:, 1]
-        dic['X'] = xr.DataArray(_X, dims=['time'], name='X', coords = {'time': _time})
-        dic['Y'] = xr.DataArray(_Y, dims=['time'], name='Y', coords = {'time': _time})
+    def save_instanton(self):
+        "Saves current instanton, overwriting the last."
+        self._submit_instanton(self.pd + '/Instanton.nc')
 
-        instanton = xr.Dataset(dic, attrs= self.parameters)
+    def save_instanton_ic(self):
+        "Saves instanton ic."
+        self._submit_instanton(self.pd + '/Instanton_IC.nc')
 
-        # Save Instanton
-        nit = self.mj.nit
-        instanton.to_netcdf(self.instanton_dir + f'/iteration_{nit}.nc')
-        print('\nInstanton saved at ' + self.instanton_dir + f'/iteration_{nit}.nc\n')
-        return
+def read_action_log(pd):
+    "(iteration, action) pairs from the action log in directory pd."
+    log = np.loadtxt(pd + '/action_log.csv', delimiter=',', skiprows=1, ndmin=2)
+    return [(int(nit), av) for nit, av in log]
 
-    def save_instanton(self):
-        "Saves instanton snapshot."
+###################################################
+## Example Run
+###################################################
 
-        # Put Instanton in xr form
-        dic = {}
-        _time = self.mj.time
-        _X = self.mj.instanton[:, 0]
-        _Y = self.mj.instanton[:, 1]
-        dic['X'] = xr.DataArray(_X, dims=['time'], name='X', coords = {'time': _time})
-        dic['Y'] = xr.DataArray(_Y, dims=['time'], name='Y', coords = {'time': _time})
+if __name__ == '__main__':
 
-        instanton = xr.Dataset(dic, attrs= self.parameters)
+    # Where Results Saved
+    sd = '/Users/cfn18/Desktop/Double-Well-Test/'
 
-        # Save Instanton
-        instanton.to_netcdf(self.pd + f'/Instanton.nc')
-        print('\nInstanton saved at ' + self.pd + f'/Instanton.nc')
-        return
+    # Warping parameter
+    alpha = 0.5
 
-    def save_instanton_ic(self):
-        "Saves instanton ic."
+    # Time over which instanton is parameterised
+    steps = 500
+    dt = 0.1
+    time = np.arange(0, dt * steps, dt)
 
-        # Put Instanton in xr form
-        dic = {}
-        _time = self.mj.time
-        _X = self.mj.instanton[:, 0]
-        _Y = self.mj.instanton[:, 1]
-        dic['X'] = xr.DataArray(_X, dims=['time'], name='X', coords = {'time': _time})
-        dic['Y'] = xr.DataArray(_Y, dims=['time'], name='Y', coords = {'time': _time})
-
-        instanton = xr.Dataset(dic, attrs= self.parameters)
-
-        # Save Instanton
-        instanton.to_netcdf(self.pd + f'/Instanton_IC.nc')
-        print('\nInstanton saved at ' + self.pd + f'/Instanton_IC.nc')
-        return
+    # Initial Instanton
+    initial_point = [1, 0]
+    final_point = [0, 0]
+    inst_ic  = np.linspace(initial_point, final_point, steps)
+
+    # Run Model
+    run_additive_mam_double_well(1, inst_ic, time, sd, bounds=None,
+                                 block_len=5, number_of_blocks=10, instanton_snapshot_blocks=[0, 1, 2, 3, 4, 5])
@@ -1,25 +1,63 @@
 # Functions to get relaxation as IC
 
+import os
+import sys
+import inspect
+from pathlib import Path
+from collections import OrderedDict
 import xarray as xr
 import numpy as np
 
-def get_relaxation(alpha, m2c):
-    relaxation_pd = '/Users/cfn18/Documents/PhD-Work/Third-Year/Instanton-Work/Double-Well-SR/Deterministic-Model/Data/'
-    
-    if m2c:
-        relaxation_file = f'alpha{alpha}'.replace('.', '_') + '/cold-relaxation.nc'
-    else:
-        relaxation_file = f'alpha{alpha}'.replace('.', '_') + '/hot-relaxation.nc'
-    
-    return xr.open_dataset(relaxation_pd + relaxation_file)
+sys.path.append(str(Path(__file__).resolve().parents[1])) # Double-Well-SR
+from deterministic_double_well import FancyWellIntegrator, warped_well_jacobian, saddle_point
+
+# Pre-saved relaxations are looked for here, read only
+relaxation_pd = str(Path(__file__).resolve().parents[1] / 'Deterministic-Model' / 'Data') + '/'
+
+def default_cache_dir():
+    "Where computed relaxations are saved, $DOUBLE_WELL_CACHE or ~/.cache/double-well-sr."
+    cache = os.environ.get('DOUBLE_WELL_CACHE', str(Path.home() / '.cache' / 'double-well-sr'))
+    return os.path.join(cache, 'relaxations') + '/'
+
+def relaxation_file(alpha, m2c, **relaxation_kwargs):
+    """
+    Relative file name used for saved relaxations. Any relaxation_kwargs,
+    the compute_relaxation settings, are recorded in the name too.
+    """
+    name = 'cold-relaxation' if m2c else 'hot-relaxation'
+    for key, value in sorted(relaxation_kwargs.items()):
+        name += f'_{key}{value:g}'
+    return f'alpha{alpha}'.replace('.', '_') + '/' + name.replace('.', '_') + '.nc'
+
+def relaxation_settings(**relaxation_kwargs):
+    "relaxation_kwargs with the rest of compute_relaxation's defaults filled in."
+    bound = inspect.signature(compute_relaxation).bind(None, None, **relaxation_kwargs)
+    bound.apply_defaults()
+    return {k: v for k, v in bound.arguments.items() if k not in ['alpha', 'm2c']}
+
+def compute_relaxation(alpha, m2c, relaxation_time=20., obs_num=2000, nudge=1.e-3):
+    """
+    Relaxation from the saddle to the cold (m2c) or hot well.
+    Starts nudge along the unstable eigenvector of the saddle and integrates
+    with FancyWellIntegrator. Dataset has x, y over time like the saved files.
+    """
+    eigenvalues, eigenvectors = np.linalg.eig(warped_well_jacobian(saddle_point, alpha))
+    v = np.real(eigenvectors[:, np.argmax(np.real(eigenvalues))])
+    v *= np.sign(v[0]) * (-1 if m2c else 1) # Point towards the right well
+
+    runner = FancyWellIntegrator(alpha, X_init=saddle_point + nudge * v)
+    obs_times = np.linspace(0, relaxation_time, obs_num)
+    states = np.vstack((runner.state, runner.integrate_observed(obs_times[1:])))
+    return xr.Dataset({'x': ('time', states[:, 0]), 'y': ('time', states[:, 1])},
+                      coords={'time': obs_times},
+                      attrs={'alpha': alpha, 'relaxation_time': relaxation_time, 'obs_num': obs_num, 'nudge': nudge})
 
 def flip_and_stretch_time(ds, time):
     "Interpolate a relaxation ds on to a reversed time."
     T = time[-1]
-    dt = time[1] - time[0] # assuming constant spacing
 
     # First flip and stretch/shorten ds.time to fit our wanted time
-    ds['time'] = np.linspace(T, 0, len(ds.time))
+    ds = ds.assign_coords(time=np.linspace(T, 0, len(ds.time)))
 
     # Now interpolate on to out desired time
     return ds.interp(time=time)
@@ -29,7 +67,90 @@ def ds_to_np(ds):
     Y = ds.y.values
     return np.column_stack((X, Y))
 
+class RelaxationICProvider:
+    """
+    Reversed relaxations as MAM initial guesses, keyed by (alpha, direction,
+    time grid).
+
+    Relaxations are read from data_dir or cache_dir, or computed with
+    compute_relaxation and saved in cache_dir if missing. Files in data_dir
+    were made with unknown settings, so they are only used when no
+    relaxation_kwargs are given. Cached files record alpha and the settings
+    in their name, so providers with different settings never share them.
+    Relaxations and the interpolated guesses are kept in memory, least
+    recently used dropped beyond maxsize.
+    """
+
+    def __init__(self, cache_dir=None, data_dir=relaxation_pd, maxsize=64, **relaxation_kwargs):
+        """
+        cache_dir: None for default_cache_dir(), so nothing is written into
+        the repository, or False to keep computed relaxations in memory only.
+        relaxation_kwargs passed to compute_relaxation, e.g. relaxation_time.
+        """
+        self.cache_dir = default_cache_dir() if cache_dir is None else cache_dir
+        self.data_dir = data_dir
+        self.maxsize = maxsize
+        self.relaxation_kwargs = relaxation_kwargs
+        self.settings = relaxation_settings(**relaxation_kwargs)
+        self._relaxations = OrderedDict()
+        self._ics = OrderedDict()
+
+    def _remember(self, cache, key, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > self.maxsize:
+            cache.popitem(last=False)
+        return value
+
+    def relaxation(self, alpha, m2c):
+        "Relaxation dataset, from memory, disk or computed in that order."
+        key = (float(alpha), bool(m2c))
+        if key in self._relaxations:
+            self._relaxations.move_to_end(key)
+            return self._relaxations[key]
+
+        saved = []
+        if self.data_dir is not None and len(self.relaxation_kwargs) == 0:
+            saved += [self.data_dir + relaxation_file(a, m2c) for a in [alpha, float(alpha)]]
+        if self.cache_dir:
+            cache_file = self.cache_dir + relaxation_file(float(alpha), m2c, **self.settings)
+            saved.append(cache_file)
+        saved = [f for f in saved if os.path.exists(f)]
+        if saved:
+            with xr.open_dataset(saved[0]) as ds:
+                ds = ds.load()
+        else:
+            ds = compute_relaxation(float(alpha), m2c, **self.settings)
+            if self.cache_dir:
+                os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+                ds.to_netcdf(cache_file)
+                print(f'Relaxation saved at {cache_file}')
+        return self._remember(self._relaxations, key, ds)
+
+    def __call__(self, alpha, c2h, time):
+        """
+        Reversed relaxation interpolated on to time, shape (len(time), 2).
+        Uses the relaxation with m2c = not c2h, as get_reversed_relaxation_ic always has.
+        """
+        time = np.asarray(time, dtype=float)
+        key = (float(alpha), bool(c2h), time.tobytes())
+        if key in self._ics:
+            self._ics.move_to_end(key)
+        else:
+            relaxation = self.relaxation(alpha, not c2h)
+            self._remember(self._ics, key, ds_to_np(flip_and_stretch_time(relaxation, time)))
+        return self._ics[key].copy() # MAM changes its instanton in place
+
+_default_provider = None
+
+def default_provider():
+    global _default_provider
+    if _default_provider is None:
+        _default_provider = RelaxationICProvider()
+    return _default_provider
+
+def get_relaxation(alpha, m2c):
+    return default_provider().relaxation(alpha, m2c)
+
 def get_reversed_relaxation_ic(alpha, c2h, time):
-    relaxation = get_relaxation(alpha, not c2h)
-    inst_ic  = flip_and_stretch_time(relaxation, time)
-    return ds_to_np(inst_ic)
\ No newline at end of file
+    return default_provider()(alpha, c2h, time)
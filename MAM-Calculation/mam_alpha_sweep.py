@@ -0,0 +1,173 @@
+"""
+MAM over a grid of alphas by continuation.
+
+##########################################
+Contents
+##########################################
+
+- Splitting the alpha grid into branches
+
+- Running a branch, each alpha warm started from its neighbour
+
+- Sweep over branches on a process pool, collected into one dataset
+
+Instantons change smoothly with alpha, so a converged instanton is a good
+initial guess at the next alpha and only the first alpha of a branch needs
+a cold start.
+"""
+
+##########################################
+## Imports
+##########################################
+
+import os
+import time as tm
+import multiprocessing
+import numpy as np
+import xarray as xr
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from double_well_action import DoubleWellMam
+
+##########################################
+## Branches
+##########################################
+
+def alpha_branches(alphas, n_branches):
+    """
+    Splits sorted alphas into n_branches contiguous pieces.
+    Each branch is ordered outward from its middle alpha, which gets the cold
+    start, then continues up and down the grid from there.
+    Returns list of (up, down) pairs of alpha lists, both starting at the middle.
+    """
+    alphas = np.sort(alphas)
+    branches = []
+    for piece in np.array_split(alphas, min(n_branches, len(alphas))):
+        mid = len(piece) // 2
+        branches.append((list(piece[mid:]), list(piece[mid::-1])))
+    return branches
+
+##########################################
+## Running a Branch
+##########################################
+
+def _cold_start(inst_ic, alpha):
+    return np.array(inst_ic(alpha) if callable(inst_ic) else inst_ic, dtype=float)
+
+def run_mam(alpha, inst_ic, time, opt):
+    "Minimises the action at one alpha. Returns the converged DoubleWellMam."
+    mam = DoubleWellMam(inst_ic, time, np.array([alpha, 1]))
+    mam.run(opt)
+    return mam
+
+def run_branch(up, down, inst_ic, time, opt):
+    """
+    Continuation along one branch.
+    up and down both start at the cold start alpha, which is solved once
+    from inst_ic, an array of shape (len(time), 2).
+    Returns dictionary of {alpha: (instanton, action, iterations, success, cold start)}.
+    """
+    results = {}
+    start = run_mam(up[0], inst_ic, time, opt)
+    results[up[0]] = (start.instanton, start.action, start.nit, start.res.success, True)
+    for alphas in [up, down]:
+        instanton = start.instanton
+        for alpha in alphas[1:]:
+            mam = run_mam(alpha, instanton, time, opt)
+            instanton = mam.instanton
+            results[alpha] = (instanton, mam.action, mam.nit, mam.res.success, False)
+    return results
+
+##########################################
+## Sweep
+##########################################
+
+def mam_alpha_sweep(alphas, inst_ic, time, n_branches=1, opt=None, n_workers=None, save_name=None):
+    """
+    Runs MAM for every alpha with continuation in alpha.
+
+    --------------------
+    Arguments
+    --------------------
+    alphas, list
+        Grid of warping parameters.
+
+    inst_ic, np.array or function
+        Cold start guess of shape (len(time), 2), or a function of alpha
+        returning one, e.g. lambda a: get_reversed_relaxation_ic(a, True, time).
+        Functions are evaluated here, only arrays are sent to the workers.
+
+    time, np.array
+        The time over which the instantons are parameterised.
+
+    n_branches, int
+        Number of independent branches, each with one cold start. Branches
+        run in parallel.
+
+    opt, dictionary
+        scipy options for each minimisation.
+
+    n_workers, int
+        Size of the pool, defaults to the smaller of n_branches and the
+        number of cores.
+
+    save_name, string
+        Optional netCDF file to save the dataset to.
+
+    Returns xr.Dataset with instantons X, Y over (alpha, time) and the action,
+    iterations, success and cold_start flags over alpha.
+    """
+    if opt is None:
+        opt = {'maxiter': 10**4, 'maxfun': 10**5}
+    branches = alpha_branches(alphas, n_branches)
+    if n_workers is None:
+        n_workers = min(len(branches), os.cpu_count())
+
+    start_time = tm.time()
+    results = {}
+    cold_starts = [_cold_start(inst_ic, up[0]) for up, down in branches]
+    if n_workers == 1:
+        for (up, down), ic in zip(branches, cold_starts):
+            results.update(run_branch(up, down, ic, time, opt))
+    else:
+        # jax is not fork safe, so workers are spawned
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=context) as pool:
+            futures = [pool.submit(run_branch, up, down, ic, time, opt)
+                       for (up, down), ic in zip(branches, cold_starts)]
+            for future in as_completed(futures):
+                results.update(future.result())
+    print(f'{len(results)} alphas with {len(branches)} cold starts in {tm.time() - start_time:.1f}s')
+
+    alpha = np.sort(list(results))
+    instantons = np.stack([results[a][0] for a in alpha])
+    dims = ['alpha', 'time']
+    ds = xr.Dataset({'X': (dims, instantons[..., 0]),
+                     'Y': (dims, instantons[..., 1]),
+                     'action': ('alpha', [results[a][1] for a in alpha]),
+                     'iterations': ('alpha', [results[a][2] for a in alpha]),
+                     'success': ('alpha', [results[a][3] for a in alpha]),
+                     'cold_start': ('alpha', [results[a][4] for a in alpha])},
+                    coords={'alpha': alpha, 'time': time},
+                    attrs={'n_branches': len(branches)})
+    if save_name is not None:
+        ds.to_netcdf(save_name)
+        print(f'Alpha sweep saved at {save_name}')
+    return ds
+
+###################################################
+## Example Run
+###################################################
+
+if __name__ == '__main__':
+
+    # Time over which instanton is parameterised
+    steps = 500
+    dt = 0.1
+    time = np.arange(0, dt * steps, dt)
+
+    # Straight line from the cold point to the saddle
+    inst_ic = np.linspace([-1, 0], [0, 0], steps)
+
+    alphas = np.linspace(0, 2, 20)
+    ds = mam_alpha_sweep(alphas, inst_ic, time, n_branches=2, save_name='alpha-sweep.nc')
+    print(ds.action.values)
@@ -1,5 +1,5 @@
 #PBS -l walltime=72:00:00
-#PBS -l select=1:ncpus=1:mem=96gb
+#PBS -l select=1:ncpus=1:mem=8gb
 #PBS -N Stochastic-Well-Simulation
 #PBS -J 1-20
 
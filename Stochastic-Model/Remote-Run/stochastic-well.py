@@ -20,12 +20,13 @@ from import_helper import *
 # Importing Double Well
 add_double_well_dir()
 from stochastic_double_well import *
+from sweep import *
+from utilities import case_dir, consolidate_transitions
+from path_density import PathDensity
 
 # Standard Imports
 import os
-import numpy.random as rm
 import time as tm
-import xarray as xr
 
 ##########################################
 ## Setting Parameters
@@ -36,20 +37,20 @@ sigmas = [0.22, 0.21, 0.2, 0.19, 0.18]
 ic = cold_point
 
 # Pair all combos of alpha and sigma
-alpha_sigmas_pairs = []
-for alpha in alphas:
-    for sigma in sigmas:
-        alpha_sigmas_pairs.append((alpha, sigma))
-
-# Use array jobs to decide input
-alpha, sigma = alpha_sigmas_pairs[int(sys.argv[1]) - 1]
+alpha_sigmas_pairs = alpha_sigma_pairs(alphas, sigmas)
 
 # Integration Length
 dt = 0.1
 T = int(1.e8) # reccomend 10**8 for sigma=0.18
-time = np.arange(0, T, dt)
+chunk_size = 10**7 # Points held in memory at once, ~160MB
+
+# Only keep transitions, found as we integrate, rather than full trajectories.
+# Saved in the Finding-Transitions layout, as if main.py had been run.
+online_transitions = False
+ball_size = 0.1 # how close to fixed point for "transitions"
 
-p = [alpha, sigma]
+# Accumulate invariant measure statistics alongside each integration
+invariant_measure = True
 
 ##########################################
 ## Save Details
@@ -60,52 +61,70 @@ number_of_integrations = 1000
 
 # Where We Save Output
 parent_dir = f'/rds/general/user/cfn18/ephemeral/Rotated-2D-Well-Stochastic-Model/'
-alpha_sub_dir = f'/alpha_{alpha}/'.replace('.', '_')
-sigma_sub_dir = f'sigma_{sigma}/'.replace('.', '_')
-if ic is cold_point:
-    ic_sub_sir = 'cold_ic/'
-elif ic is hot_point:
-    ic_sub_sir = 'hot_ic/'
-
-save_directory = str(parent_dir) + alpha_sub_dir + sigma_sub_dir + ic_sub_sir
-
-if not os.path.exists(save_directory):
-    os.makedirs(save_directory)
-    
-def save_result():
-    # xr setup
-    dims = ['x', 'y']
-    coords = [time]
-    attrs = {'alpha': alpha, 'sigma': sigma}
-    
-    # Creating xr.Dataset
-    data = integration_result
-    x_data = xr.DataArray(data[:, 0], coords = {'time': time},
-                        dims = ['time'], attrs=attrs, name='x')
-    y_data = xr.DataArray(data[:, 1],  coords = {'time': time},
-                        dims = ['time'], attrs=attrs, name='y')
-    ensemble_ds = xr.merge([x_data, y_data])
-    ensemble_ds.attrs = attrs
-    
-    # Saving Dataset
-    save_name = save_directory + f'{i+1}'
-    ensemble_ds.to_netcdf(save_name + '.nc')
-    print(f'Saved at {save_name}\n')
-        
+
+def save_directory(alpha, sigma):
+    alpha_sub_dir = f'/alpha_{alpha}/'.replace('.', '_')
+    sigma_sub_dir = f'sigma_{sigma}/'.replace('.', '_')
+    if ic is cold_point:
+        ic_sub_sir = 'cold_ic/'
+    elif ic is hot_point:
+        ic_sub_sir = 'hot_ic/'
+    return str(parent_dir) + alpha_sub_dir + sigma_sub_dir + ic_sub_sir
+
+def is_complete(alpha, sigma):
+    return is_marked_complete(save_directory(alpha, sigma))
+
 ##########################################
 ## Running and Saving in Blocks
 ##########################################
 
-print('**STARTING INTEGRATION**\n')
-
-for i in range(number_of_integrations):
+def run_case(alpha, sigma):
+    p = [alpha, sigma]
+    sd = save_directory(alpha, sigma)
+    if not os.path.exists(sd):
+        os.makedirs(sd)
+
+    print(f'**STARTING INTEGRATION alpha = {alpha}, sigma = {sigma}**\n')
+
+    for i in range(number_of_integrations):
+
+        # Integrations finished before an interruption are not rerun
+        done_marker = sd + f'.done_{i+1}'
+        if os.path.exists(done_marker):
+            continue
+
+        print(f'Running Integration {i} of {number_of_integrations}\n')
+        start = tm.time()
+        measure = InvariantMeasure(ball_size=ball_size, attrs={'alpha': alpha, 'sigma': sigma}) if invariant_measure else None
+        if online_transitions:
+            attrs = {'alpha': alpha, 'sigma': sigma, 'ball_size': ball_size}
+            densities = {'c2h': PathDensity(attrs=attrs), 'h2c': PathDensity(attrs=attrs)}
+            save_em_transitions(ic, T, dt, p, case_dir(alpha, sigma, cluster=True), ball_size, chunk_size,
+                                prefix=f'{i+1}_', densities=densities, measure=measure, source_file=f'{sd}{i+1}')
+        else:
+            save_name = sd + f'{i+1}.nc'
+            checkpoint = save_name + '.checkpoint' # Resumed from if the job died part way
+            measure = save_em_stream(ic, T, dt, p, save_name, chunk_size, checkpoint=checkpoint, measure=measure) # Integrate & save in chunks
+        if measure is not None:
+            measure.save(sd + f'{i+1}-invariant-measure.nc')
+        open(done_marker, 'w').close()
+        end = tm.time()
+        time_in_hours = (end - start)/60**2
+        print(f'Integration {i} took approximately {time_in_hours:.2g} hours.')
+
+    # One store per direction and one catalogue for the whole case
+    td = case_dir(alpha, sigma, cluster=True)
+    if online_transitions and not os.path.exists(td + 'catalogue.nc'):
+        consolidate_transitions(td, [f'{i+1}_' for i in range(number_of_integrations)])
+    mark_complete(sd)
 
-    print(f'Running Integration {i} of {number_of_integrations}\n')
-    start = tm.time()
-    integration_result = double_well_em(ic, time, p)
-    end = tm.time()
-    time_in_hours = (end - start)/60**2
-    print(f'Integration {i} took approximately {time_in_hours:.2g} hours.')
+##########################################
+## Array job or local sweep
+##########################################
 
-    # Save
-    save_result()
+if __name__ == "__main__":
+    if len(sys.argv) > 1: # Use array jobs to decide input
+        run_case(*array_job_pair(alpha_sigmas_pairs, sys.argv))
+    else: # Fill every core of this machine
+        # Every case integrates the same length of time, so no case goes first
+        run_sweep(run_case, alpha_sigmas_pairs, is_complete, cost=lambda alpha, sigma: 1)
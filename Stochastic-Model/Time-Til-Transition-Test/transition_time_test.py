@@ -16,6 +16,7 @@ from import_helper import *
 add_double_well_dir()
 from stochastic_double_well import *
 from deterministic_double_well import *
+from sweep import alpha_sigma_pairs, run_sweep
 from joblib import Parallel, delayed
 
 import os
@@ -34,6 +35,11 @@ time = np.arange(0, block_length, dt)
 alpha = 0.
 sigmas = [0.3, 0.25, 0.2, 0.19, 0.18, 0.17, 0.16, 0.15, 0.14, 0.13]
 ic = cold_point 
+target_transitions = 100 # Quit once we have this many
+
+# Use the vectorised first passage sampler rather than the block search
+first_passage = True
+n_walkers = 20 # Walkers stepped together by first_passage_times, at most target_transitions
 
 # Functions Needed for Experiment
 
@@ -43,7 +49,7 @@ def cold_in_ts(x):
 def hot_in_ts(x):
     return np.any(x[:, 0] > 0)
 
-def update_results():
+def update_results(experiment_results, cpu_time, integration_time):
     experiment_results['cpu_times(s)'].append(cpu_time)
     experiment_results['integration_times'].append(integration_time)
     experiment_results['number_of_transitions'] += 1
@@ -55,15 +61,19 @@ def save_directory(alpha):
     else:
         return f'/rds/general/user/cfn18/home/Double-Well-SR/Stochastic-Model/Time-Til-Transition-Test/Timing-Results/alpha_{alpha:.2f}'.replace('.', '_')
         
-def save_results():
+def results_file(alpha, sigma):
+    return save_directory(alpha) + f'/sigma_{sigma:.3f}_results'.replace('.', '_') + '.pickle'
+
+def save_results(experiment_results, alpha, sigma):
     save_dir = save_directory(alpha)
     if not os.path.exists(save_dir):
         os.makedirs(save_dir)
-    with open(save_dir + f'/sigma_{sigma:.3f}_results'.replace('.', '_') + '.pickle', 'wb') as handle:
+    with open(results_file(alpha, sigma), 'wb') as handle:
         pickle.dump(experiment_results, handle)
     print(f'\nSaved Results at {save_dir}/sigma_{sigma:.3f}_results.pickle\n')
 
 def experiment_header(p):
+    alpha, sigma = p
     print('\n***RUNNING EXPERIMENT****')
     print()
     print(f'alpha = {alpha}, sigma  = {sigma}')
@@ -80,10 +90,17 @@ def load_results(alpha):
             results.append(pickle.load(handle))
     return results
 
+def is_complete(alpha, sigma):
+    "Have we already collected enough transitions for this case?"
+    if not os.path.exists(results_file(alpha, sigma)):
+        return False
+    with open(results_file(alpha, sigma), 'rb') as handle:
+        return pickle.load(handle)['number_of_transitions'] >= target_transitions
+
 # Running the Experiment
-if __name__ == "__main__":
-    sigma = sigmas[int(sys.argv[1]) - 1]
+def run_case(alpha, sigma):
     p = [alpha, sigma]
+    ic = cold_point
     
     # Initialising Results
     experiment_results = {'sigma': sigma, 'cpu_times(s)': [], 'integration_times': [], 'number_of_transitions': 0}
@@ -100,16 +117,51 @@ if __name__ == "__main__":
             end = tm.time()
             cpu_time = end - start
             integration_time = (i - last_success_block + 1) * time[-1]
-            update_results()
-            save_results()
+            update_results(experiment_results, cpu_time, integration_time)
+            save_results(experiment_results, alpha, sigma)
 
             # Check if we have enough samples
-            if experiment_results['number_of_transitions'] == 100:
-                print(f'Found 100 transitions - will quit.')
-                quit()  
-           
+            if experiment_results['number_of_transitions'] == target_transitions:
+                print(f'Found {target_transitions} transitions - will quit.')
+                return experiment_results
 
             # Reset Experiment
             ic = cold_point
             last_success_block = i
             start = tm.time()
+    return experiment_results
+
+def run_case_first_passage(alpha, sigma):
+    """
+    Same experiment with many walkers stepped at once, times exact to dt.
+
+    Walkers in flight when target_transitions is reached are run to their
+    transition, so up to target_transitions + n_walkers - 1 times are saved.
+    Like run_case it stops after number_of_blocks * block_length of
+    integration time, here per walker.
+
+    Transitions are not timed one by one, so 'cpu_times(s)' holds the total
+    wall time over the number of transitions, once per transition. It stays
+    aligned with 'integration_times' as in run_case, and the total is kept
+    under 'total_cpu_time(s)'.
+    """
+    p = [alpha, sigma]
+    experiment_header(p)
+    start = tm.time()
+    hitting_times = first_passage_times(p, target_transitions, min(n_walkers, target_transitions), dt,
+                                        target='x>0', max_steps=int(number_of_blocks * block_length / dt))
+    cpu_time = tm.time() - start
+    experiment_results = {'sigma': sigma,
+                          'cpu_times(s)': [cpu_time / max(len(hitting_times), 1)] * len(hitting_times),
+                          'total_cpu_time(s)': cpu_time,
+                          'integration_times': list(hitting_times),
+                          'number_of_transitions': len(hitting_times)}
+    save_results(experiment_results, alpha, sigma)
+    return experiment_results
+
+if __name__ == "__main__":
+    case = run_case_first_passage if first_passage else run_case
+    if len(sys.argv) > 1: # Use array jobs to decide sigma
+        case(alpha, sigmas[int(sys.argv[1]) - 1])
+    else: # Run every sigma over the cores of this machine
+        run_sweep(case, alpha_sigma_pairs([alpha], sigmas), is_complete)
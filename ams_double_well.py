@@ -0,0 +1,233 @@
+"""
+Adaptive multilevel splitting (AMS) for rare cold to hot transitions.
+
+##########################################
+Contents
+##########################################
+
+- Reaction coordinates and the A/B balls
+
+- Brute force phase: starting states on the level just outside A
+
+- AMS iterations on top of the EM kernel
+
+- Rate estimate over several independent AMS runs
+
+The transition rate is estimated as k = p / tau, where p is the probability
+that a trajectory leaving A through the starting level reaches B before A,
+and tau is the mean time between successive departures from A.
+"""
+
+##########################################
+## Imports
+##########################################
+
+import numpy as np
+from tqdm.notebook import tqdm
+from deterministic_double_well import hot_point, cold_point
+from stochastic_double_well import _em_kernel
+
+##########################################
+## Reaction Coordinates
+##########################################
+
+def reaction_coordinate(name):
+    """
+    Reaction coordinate, increasing from the cold to the hot well.
+    'x', the x coordinate.
+    'distance', minus the distance to hot_point.
+    """
+    if name == 'x':
+        return lambda x: x[..., 0]
+    elif name == 'distance':
+        return lambda x: - np.sqrt(np.sum((x - hot_point)**2, axis=-1))
+    raise ValueError(f"reaction coordinate should be 'x' or 'distance', not {name!r}")
+
+def _in_ball(x, centre, ball_size):
+    return np.sum((x - centre)**2, axis=-1) < ball_size**2
+
+##########################################
+## Running a Replica
+##########################################
+
+def _run_until_absorbed(x0, p, dt, rng, ball_size, chunk=1000, max_steps=10**7):
+    """
+    EM path from x0 until it enters the cold ball A or the hot ball B.
+    Returns (path, reached_B).
+    """
+    alpha, sigma = float(p[0]), float(p[1])
+    dts = np.full(chunk, float(dt))
+    pieces = [np.atleast_2d(x0)]
+    last = x0
+    for _ in range(max_steps // chunk):
+        buf = np.zeros((chunk + 1, 2))
+        buf[0] = last
+        _em_kernel(buf, dts, rng.standard_normal((chunk, 2)), alpha, sigma)
+        new = buf[1:]
+        in_A = _in_ball(new, cold_point, ball_size)
+        in_B = _in_ball(new, hot_point, ball_size)
+        stop = np.flatnonzero(in_A | in_B)
+        if len(stop):
+            i = stop[0]
+            pieces.append(new[:i+1])
+            return np.concatenate(pieces), bool(in_B[i])
+        pieces.append(new)
+        last = new[-1]
+    return np.concatenate(pieces), False
+
+##########################################
+## Brute Force Phase
+##########################################
+
+def starting_states(n, p, dt, xi, z_start, ball_size, rng, chunk=10**5):
+    """
+    Runs EM from cold_point, collecting the first point beyond z_start after
+    each visit to A.
+    Returns (states, tau) with tau the mean time between these departures.
+    """
+    alpha, sigma = float(p[0]), float(p[1])
+    dts = np.full(chunk, float(dt))
+    buf = np.zeros((chunk + 1, 2))
+    buf[0] = cold_point
+    last_tag = 1 # 1 in A, 2 beyond z_start
+    states = []
+    steps = 0
+    while len(states) < n:
+        _em_kernel(buf, dts, rng.standard_normal((chunk, 2)), alpha, sigma)
+        new = buf[1:]
+
+        # Walkers that make it all the way to B are sent back to A
+        in_B = np.flatnonzero(_in_ball(new, hot_point, ball_size))
+        reached_B = len(in_B) > 0
+        if reached_B:
+            new = new[:in_B[0]]
+            buf[0] = cold_point
+        else:
+            buf[0] = new[-1]
+
+        # Departures in this chunk, against the tag carried over from the last
+        tags = np.where(_in_ball(new, cold_point, ball_size), 1, 0)
+        tags[xi(new) > z_start] = 2
+        tagged = np.flatnonzero(tags)
+        values = tags[tagged]
+        previous = np.append(last_tag, values[:-1])
+        departures = tagged[(values == 2) & (previous == 1)]
+        states.extend(new[departures])
+        if reached_B: # The next chunk starts in A
+            last_tag = 1
+        elif len(values):
+            last_tag = values[-1]
+        steps += len(new)
+    tau = steps * dt / len(states)
+    return np.array(states[:n]), tau
+
+##########################################
+## AMS
+##########################################
+
+def ams(p, n_replicas=100, dt=0.1, coordinate='x', ball_size=0.1, z_start=None,
+        k=1, seed=None, max_iterations=10**5, timer=False):
+    """
+    One run of adaptive multilevel splitting from the cold to the hot well.
+
+    --------------------
+    Arguments
+    --------------------
+    p, (alpha, sigma)
+
+    n_replicas, int
+        Number of replicas N.
+
+    coordinate, string
+        Reaction coordinate, see reaction_coordinate.
+
+    ball_size, float
+        Radius of the balls A and B around cold_point and hot_point.
+
+    z_start, float
+        Level just outside A the replicas start from. Defaults to the
+        coordinate of cold_point + (2 * ball_size, 0).
+
+    k, int
+        Replicas killed per iteration at least.
+
+    Returns dictionary with the probability of reaching B before A, the rate
+    estimate, the mean time between departures from A (cycle_time), the
+    number of iterations, the levels, the asymptotic relative variance
+    -log(p) / N and the reactive paths found.
+    """
+    rng = np.random.default_rng(seed)
+    xi = reaction_coordinate(coordinate)
+    if z_start is None:
+        z_start = xi(cold_point + np.array([2 * ball_size, 0]))
+
+    # Initial replicas, from states on the starting level
+    states, tau = starting_states(n_replicas, p, dt, xi, z_start, ball_size, rng)
+    replicas = [_run_until_absorbed(x0, p, dt, rng, ball_size) for x0 in states]
+
+    def score(replica):
+        path, reached_B = replica
+        return np.inf if reached_B else xi(path).max()
+
+    scores = np.array([score(r) for r in replicas])
+    probability = 1.
+    levels = []
+    pbar = tqdm(total=max_iterations, disable=not timer)
+    for iteration in range(max_iterations):
+        if np.all(np.isinf(scores)):
+            break
+
+        # Kill everything at or below the k-th lowest level
+        z = np.sort(scores)[k-1]
+        killed = np.flatnonzero(scores <= z)
+        survivors = np.flatnonzero(scores > z)
+        if len(survivors) == 0: # Extinction, nothing got past z
+            probability = 0.
+            break
+        probability *= 1 - len(killed) / n_replicas
+        levels.append(z)
+
+        # Branch killed replicas from survivors where they first pass z
+        for i in killed:
+            path = replicas[rng.choice(survivors)][0]
+            j = np.argmax(xi(path) > z)
+            new_path, reached_B = _run_until_absorbed(path[j], p, dt, rng, ball_size)
+            replicas[i] = (np.concatenate((path[:j], new_path)), reached_B)
+            scores[i] = score(replicas[i])
+        pbar.update(1)
+    pbar.close()
+
+    reached_B = np.isinf(scores)
+    probability *= reached_B.mean()
+    return {'probability': probability,
+            'rate': probability / tau,
+            'cycle_time': tau,
+            'iterations': len(levels),
+            'levels': np.array(levels),
+            'relative_variance': -np.log(probability) / n_replicas if probability > 0 else np.inf,
+            'paths': [replicas[i][0] for i in np.flatnonzero(reached_B)],
+            'n_replicas': n_replicas}
+
+def ams_rate(p, n_runs=10, seed=None, **kwargs):
+    """
+    Repeats ams over n_runs independent streams.
+    Returns dictionary with the mean rate and probability, their empirical
+    relative variance over runs next to the asymptotic one, per run values
+    and every reactive path found.
+    kwargs are passed on to ams.
+    """
+    seeds = np.random.SeedSequence(seed).spawn(n_runs)
+    runs = [ams(p, seed=s, **kwargs) for s in seeds]
+    probabilities = np.array([r['probability'] for r in runs])
+    rates = np.array([r['rate'] for r in runs])
+    p_mean = probabilities.mean()
+    return {'rate': rates.mean(),
+            'probability': p_mean,
+            'rate_std': rates.std(ddof=1) if n_runs > 1 else np.nan,
+            'empirical_relative_variance': probabilities.var(ddof=1) / p_mean**2 if n_runs > 1 else np.nan,
+            'asymptotic_relative_variance': np.mean([r['relative_variance'] for r in runs]),
+            'rates': rates,
+            'probabilities': probabilities,
+            'cycle_times': np.array([r['cycle_time'] for r in runs]),
+            'iterations': np.array([r['iterations'] for r in runs]),
+            'paths': [path for r in runs for path in r['paths']]}
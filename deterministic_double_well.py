@@ -11,6 +11,8 @@ Contents
 
 - Deterministic integrator & Trajectory Observer
 
+- Batched relaxation ensemble integrator
+
 """
 
 ##########################################
@@ -39,6 +41,30 @@ def grad_V(x):
 def warped_well(x, alpha):
     return - (np.eye(2) + alpha * R) @ grad_V(x)
 
+def warped_well_jacobian(x, alpha):
+    "Analytic Jacobian of warped_well."
+    return - (np.eye(2) + alpha * R) @ np.diag([3 * x[0]**2 - 1, 2])
+
+# Vectorised
+def batch_warped_well(x, alpha):
+    """
+    Closed form of warped_well acting on the last axis of x.
+    x has shape (..., 2), e.g. (n_realisations, 2).
+    """
+    gx = x[..., 0] * (x[..., 0]**2 - 1)
+    gy = 2 * x[..., 1]
+    return np.stack((alpha * gy - gx, - alpha * gx - gy), axis=-1)
+
+def batch_warped_well_jacobian(x, alpha):
+    """
+    Closed form of warped_well_jacobian acting on the last axis of x.
+    Returns array of shape (..., 2, 2).
+    """
+    hx = 3 * x[..., 0]**2 - 1
+    hy = 2 * np.ones_like(x[..., 1])
+    return np.stack((np.stack((-hx, alpha * hy), axis=-1),
+                     np.stack((-alpha * hx, -hy), axis=-1)), axis=-2)
+
 # jNumpy
 import jax.numpy as jnp
 def jax_grad_V(x):
@@ -80,6 +106,9 @@ class FancyWellIntegrator:
     def _rhs_dt(self, t, state):
         return warped_well(state, self.alpha)
 
+    def _jac_dt(self, t, state):
+        return warped_well_jacobian(state, self.alpha)
+
     def integrate(self, how_long):
         """time: how long we integrate for in adimensional time."""
 
@@ -94,6 +123,27 @@ class FancyWellIntegrator:
         self.set_state(solver_return.y[:,-1])
         self.time = t + how_long
 
+    def integrate_observed(self, obs_times, method='RK45'):
+        """
+        Integrates up to obs_times[-1] with a single solver call.
+        obs_times: increasing times after self.time at which we want the state.
+        method: any scipy.integrate.solve_ivp method. Implicit methods
+        ('Radau', 'BDF', 'LSODA') are given the analytic Jacobian.
+        Returns the states at obs_times, shape (len(obs_times), 2).
+        """
+        t = self.time
+        IC = self.state
+        kwargs = {'jac': self._jac_dt} if method in ['Radau', 'BDF', 'LSODA'] else {}
+
+        # Solver dense output evaluated at every observation time
+        solver_return = scipy.integrate.solve_ivp(self._rhs_dt, (t, obs_times[-1]), IC,
+                                                  method=method, t_eval=obs_times, **kwargs)
+
+        # Updating variables
+        self.set_state(solver_return.y[:,-1])
+        self.time = obs_times[-1]
+        return solver_return.y.T
+
     def set_state(self, x):
         """x is [X, T]."""
         self._state =x
@@ -116,60 +166,121 @@ class FancyWellIntegrator:
 # ------------------------------------------
 
 class TrajectoryObserver():
-    """Observes the trajectory of Asymettric Double Well. Dumps to netcdf."""
+    """Observes the trajectory of Asymettric Double Well. Dumps to netcdf.
+    Observations live in a preallocated array that doubles when full."""
+
+    __slots__ = ['_parameters', 'name', 'dump_count', 'cupboard', 'max_obs', '_log', '_n']
 
-    def __init__(self, integrator, name='Fancy2Well'):
-        """param, integrator: integrator being observed."""
+    def __init__(self, integrator, name='Fancy2Well', cupboard=None, max_obs=None, capacity=1024):
+        """param, integrator: integrator being observed.
+        name: file name used when dumping.
+        cupboard: Directory to spill observations to.
+        max_obs: if given with cupboard, observations are dumped to the
+        cupboard automatically whenever this many have been made.
+        capacity: initial size of the observation log."""
 
         # Needed knowledge of the integrator
         self._parameters = integrator.parameter_dict
 
-        # Trajectory Observation logs
-        self.time_obs = [] # Times we've made observations
-        self.x_obs = []
-        self.y_obs = []
+        # Dumping details
+        self.name = name
+        self.dump_count = 0
+        self.cupboard = cupboard
+        self.max_obs = max_obs
+
+        # Trajectory Observation log, columns are time, x, y
+        if max_obs is not None:
+            capacity = min(capacity, max_obs)
+        self._log = np.zeros((capacity, 3))
+        self._n = 0
+
+    @property
+    def time_obs(self):
+        "Times we've made observations"
+        return self._log[:self._n, 0]
+
+    @property
+    def x_obs(self):
+        return self._log[:self._n, 1]
+
+    @property
+    def y_obs(self):
+        return self._log[:self._n, 2]
+
+    def _grow(self, n):
+        "Make room for n more observations."
+        if self._n + n > len(self._log):
+            capacity = max(2 * len(self._log), self._n + n)
+            log = np.zeros((capacity, 3))
+            log[:self._n] = self._log[:self._n]
+            self._log = log
+
+    def _spill(self):
+        "Dump to the cupboard if we've hit max_obs."
+        if self.cupboard is not None and self.max_obs is not None and self._n >= self.max_obs:
+            self.dump(self.cupboard)
 
     def look(self, integrator):
         """Observes trajectory """
+        self._grow(1)
+        self._log[self._n, 0] = integrator.time
+        self._log[self._n, 1:] = integrator.state
+        self._n += 1
+        self._spill()
+        return
 
-        # Note the time
-        self.time_obs.append(integrator.time)
-
-        # Making Observations
-        self.x_obs.append(integrator.state[0].copy())
-        self.y_obs.append(integrator.state[1].copy())
+    def look_many(self, times, states):
+        """Records many observations at once.
+        times, observation times.
+        states, array of shape (len(times), 2)."""
+        times = np.asarray(times)
+        states = np.asarray(states)
+        start = 0
+        while start < len(times):
+            n = len(times) - start
+            if self.cupboard is not None and self.max_obs is not None:
+                n = min(n, self.max_obs - self._n)
+            self._grow(n)
+            self._log[self._n:self._n + n, 0] = times[start:start + n]
+            self._log[self._n:self._n + n, 1:] = states[start:start + n]
+            self._n += n
+            start += n
+            self._spill()
         return
 
     @property
     def observations(self):
-        """cupboard: Directory where to write netcdf."""
-        if (len(self.x_obs) == 0):
+        """Observations so far as an xr.Dataset."""
+        if (self._n == 0):
             print('I have no observations! :(')
             return
 
         dic = {}
-        _time = self.time_obs
-        dic['X'] = xr.DataArray(self.x_obs, dims=['time'], name='X',
+        _time = self.time_obs.copy()
+        dic['X'] = xr.DataArray(self.x_obs.copy(), dims=['time'], name='X',
                                 coords = {'time': _time})
-        dic['Y'] = xr.DataArray(self.y_obs, dims=['time'], name='Y',
+        dic['Y'] = xr.DataArray(self.y_obs.copy(), dims=['time'], name='Y',
                                 coords = {'time': _time})
         return xr.Dataset(dic, attrs= self._parameters)
 
     def wipe(self):
         """Erases observations"""
-        self.time_obs = []
-        self.x_obs = []
-        self.y_obs = []
+        self._n = 0
 
-    def dump(self, cupboard, name=None):
+    def dump(self, cupboard=None, name=None):
         """ Saves observations to netcdf and wipes.
-        cupboard: Directory where to write netcdf.
+        cupboard: Directory where to write netcdf, defaults to self.cupboard.
         name: file name"""
 
-        if (len(self.x_obs) == 0):
+        if (self._n == 0):
             print('I have no observations! :(')
             return
 
+        if cupboard is None:
+            cupboard = self.cupboard
+        if cupboard is None:
+            raise ValueError('No cupboard to dump to, pass one or set it when making the observer.')
+
         if name == None:
             name=self.name
 
@@ -183,12 +294,66 @@ class TrajectoryObserver():
 # make_observations
 # ------------------------------------------
 
-def make_observations(runner, looker, obs_num, obs_freq, noprog=True):
+def make_observations(runner, looker, obs_num, obs_freq, noprog=True, single_call=False, method='RK45'):
     """Makes observations given runner and looker.
     runner, integrator object.
     looker, observer object.
     obs_num, how many observations you want.
-    obs_freq, adimensional time between observations"""
+    obs_freq, adimensional time between observations
+    single_call, integrate the whole horizon in one solver call and fill
+    looker in bulk, rather than restarting the solver every observation.
+    method, solver used when single_call is True."""
+    if single_call:
+        obs_times = runner.time + obs_freq * np.arange(1, int(obs_num) + 1)
+        states = runner.integrate_observed(obs_times, method=method)
+        looker.look_many(obs_times, states)
+        return
+
     for step in tqdm(np.repeat(obs_freq, obs_num), disable=noprog):
         runner.integrate(obs_freq)
         looker.look(runner)
+
+##########################################
+## Batched Relaxation Ensemble
+##########################################
+
+def _rk4_step(x, alpha, dt):
+    k1 = batch_warped_well(x, alpha)
+    k2 = batch_warped_well(x + 0.5 * dt * k1, alpha)
+    k3 = batch_warped_well(x + 0.5 * dt * k2, alpha)
+    k4 = batch_warped_well(x + dt * k3, alpha)
+    return x + dt * (k1 + 2 * k2 + 2 * k3 + k4) / 6
+
+def relaxation_ensemble(ics, alpha, obs_num, obs_freq, dt=0.01, noprog=True):
+    """Integrates an ensemble of initial conditions together with fixed step RK4.
+    ics, array of shape (n_ic, 2).
+    alpha, float or array of length n_ic, so one call can cover a grid of
+    alphas, e.g. alpha=np.repeat(alphas, n) with ics=np.tile(ics, (len(alphas), 1)).
+    obs_num, how many observations you want.
+    obs_freq, adimensional time between observations.
+    dt, largest RK4 step used between observations.
+    Returns xr.Dataset of X, Y with dims (realisation, time), as make_observations
+    would give for each initial condition."""
+    x = np.array(ics, dtype=float)
+    alpha = np.asarray(alpha, dtype=float)
+    substeps = int(np.ceil(obs_freq / dt - 1e-9))
+    h = obs_freq / substeps
+    obs_num = int(obs_num)
+
+    obs = np.zeros((obs_num, *x.shape))
+    for i in tqdm(range(obs_num), disable=noprog):
+        for _ in range(substeps):
+            x = _rk4_step(x, alpha, h)
+        obs[i] = x
+
+    time = obs_freq * np.arange(1, obs_num + 1)
+    coords = {'realisation': np.arange(len(x)) + 1, 'time': time}
+    attrs = {}
+    if alpha.ndim == 0:
+        attrs['alpha'] = alpha.item()
+    else:
+        coords['alpha'] = ('realisation', alpha)
+    dic = {}
+    dic['X'] = xr.DataArray(obs[:, :, 0].T, dims=['realisation', 'time'], name='X', coords=coords)
+    dic['Y'] = xr.DataArray(obs[:, :, 1].T, dims=['realisation', 'time'], name='Y', coords=coords)
+    return xr.Dataset(dic, attrs=attrs)
@@ -8,11 +8,15 @@ Contents
 - DoubleWellPath class
 
 - Fixed points of the well
+
+- Cached vector field backgrounds
 """
 
 import numpy as np
 import xarray as xr
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.collections import LineCollection
 
 ##########################################
 ## Plotting Functions
@@ -24,29 +28,86 @@ def init_2d_fax():
     ax = plt.axes()
     return fig, ax
 
-def fancy_well_background_plot(alpha, fax=None):
+class WellBackground:
+    """
+    Speed and streamlines of the warped well flow for one alpha, computed
+    once and stamped onto any number of axes.
+    """
 
-    if fax is None:
-        fig, ax = init_2d_fax()
-    else:
-        fig, ax = fax
+    def __init__(self, alpha, x_range=(-1.5, 1.5), y_range=(-1, 1), n=100):
+        self.alpha = alpha
+        self.x_range = x_range
+        self.y_range = y_range
+
+        # Gradient Arrows
+        x = np.linspace(*x_range, n)
+        y = np.linspace(*y_range, n)
+        self.X, self.Y = np.meshgrid(x, y)
+        vx = self.X*(self.X**2 - 1) - 2 * alpha * self.Y
+        vy = alpha *self.X*(self.X**2 - 1) + 2 * self.Y
+        self.speed = np.sqrt(vx**2 + vy**2)
+
+        # Streamline geometry, from a streamplot on a figure that is never shown
+        streams = Figure().add_subplot().streamplot(x, y, -vx, -vy)
+        self.segments = streams.lines.get_segments()
+        self.arrow_heads, self.arrow_directions = self._arrows(self.segments)
+
+    @staticmethod
+    def _arrows(segments):
+        """
+        Splits the segments back into streamlines and places an arrow halfway
+        along each, where streamplot puts them.
+        Returns arrow heads and unit directions.
+        """
+        arrows = []
+        start = 0
+        for k in range(1, len(segments) + 1):
+            if k < len(segments) and np.array_equal(segments[k][0], segments[k-1][-1]):
+                continue
+            line = np.vstack([segments[start][:1]] + [seg[1:] for seg in segments[start:k]])
+            steps = np.linalg.norm(np.diff(line, axis=0), axis=1)
+            moving = np.flatnonzero(steps > 0)
+            if len(moving):
+                s = np.concatenate(([0], np.cumsum(steps)))
+                i = np.searchsorted(s, s[-1] / 2.)
+                i = moving[np.argmin(np.abs(moving - i))] # Skip repeated points
+                arrows.append((line[i:i+2].mean(axis=0), line[i+1] - line[i]))
+            start = k
+        heads, directions = np.array(arrows).reshape(-1, 2, 2).transpose(1, 0, 2)
+        return heads, directions / np.linalg.norm(directions, axis=1, keepdims=True)
+
+    def stamp(self, fax=None, stream_color='1', speed=True, cmap='Purples'):
+        "Draws the background on fax, streamlines in stream_color over the speed."
+        if fax is None:
+            fig, ax = init_2d_fax()
+        else:
+            fig, ax = fax
 
-    # Plot Misc
-    x_range = (-1.5, 1.5)
-    y_range = (-1, 1)
-    ax.set_xlim(x_range)
-    ax.set_ylim(y_range)
-
-    # Gradient Arrows
-    x = np.linspace(*x_range, 100)
-    y = np.linspace(*y_range, 100)
-    X, Y = np.meshgrid(x, y)
-    vx = X*(X**2 - 1) - 2 * alpha * Y
-    vy = alpha *X*(X**2 - 1) + 2 * Y
-    speed = np.sqrt(vx**2 + vy**2)
-    ax.streamplot(x, y, -vx, -vy, color='1')
-    ax.pcolormesh(X, Y, speed, cmap = 'Purples', shading='auto')
-    return fig, ax
+        # Plot Misc
+        ax.set_xlim(self.x_range)
+        ax.set_ylim(self.y_range)
+
+        # Streamlines and arrows as one artist each
+        ax.add_collection(LineCollection(self.segments, colors=stream_color, zorder=2))
+        head, direction = self.arrow_heads, self.arrow_directions
+        ax.quiver(head[:, 0], head[:, 1], direction[:, 0], direction[:, 1], color=stream_color,
+                  angles='xy', pivot='tip', scale=50, width=0.005, headwidth=3.5, headlength=4,
+                  headaxislength=3.5, zorder=2)
+        if speed:
+            ax.pcolormesh(self.X, self.Y, self.speed, cmap=cmap, shading='auto')
+        return fig, ax
+
+_backgrounds = {}
+
+def well_background(alpha, x_range=(-1.5, 1.5), y_range=(-1, 1), n=100):
+    "WellBackground for alpha, only computed the first time it is asked for."
+    key = (float(alpha), tuple(x_range), tuple(y_range), n)
+    if key not in _backgrounds:
+        _backgrounds[key] = WellBackground(alpha, x_range, y_range, n)
+    return _backgrounds[key]
+
+def fancy_well_background_plot(alpha, fax=None):
+    return well_background(alpha).stamp(fax)
 
     # alpha label
 def alpha_label_box(alpha, ax, xpos=0, ypos=0):
@@ -0,0 +1,144 @@
+"""
+Invariant measure statistics accumulated while integrating.
+
+##########################################
+Contents
+##########################################
+
+- InvariantMeasure class: joint and marginal histograms, moments and
+  well occupancy, updated a chunk at a time
+
+"""
+
+##########################################
+## Imports
+##########################################
+
+import numpy as np
+import xarray as xr
+from deterministic_double_well import cold_point, hot_point
+from path_density import PathDensity
+
+##########################################
+## InvariantMeasure Definition
+##########################################
+
+def _bin_counts(v, edges):
+    "1D counts on a uniform grid, right edge included. Returns (counts, n_outside)."
+    bins = len(edges) - 1
+    inside = (v >= edges[0]) & (v <= edges[-1])
+    i = np.minimum(((v[inside] - edges[0]) / (edges[-1] - edges[0]) * bins).astype(int), bins - 1)
+    return np.bincount(i, minlength=bins), int(np.sum(~inside))
+
+class InvariantMeasure:
+    """
+    Running estimate of the invariant measure from points along trajectories.
+    Keeps a joint (x, y) histogram, finer x and y marginals, first and second
+    moments and the fraction of time spent in each well and each ball.
+    """
+
+    def __init__(self, x_range=(-2, 2), y_range=(-1, 1), bins=100, marginal_bins=500,
+                 ball_size=0.1, attrs=None):
+        "Default ranges match the plots in Invariant-Measure.ipynb."
+        self.joint = PathDensity(x_range, y_range, bins, attrs)
+        self.x_edges = np.linspace(*x_range, marginal_bins + 1)
+        self.y_edges = np.linspace(*y_range, marginal_bins + 1)
+        self.x_counts = np.zeros(marginal_bins, dtype=np.int64)
+        self.y_counts = np.zeros(marginal_bins, dtype=np.int64)
+        self.ball_size = ball_size
+        self.attrs = {} if attrs is None else dict(attrs)
+
+        # Running sums
+        self.n = 0
+        self.sums = dict.fromkeys(['x', 'y', 'xx', 'yy', 'xy', 'cold_well', 'hot_well',
+                                   'cold_ball', 'hot_ball'], 0.)
+
+    def update(self, x):
+        "Add points, x has shape (n, 2)."
+        X = x[:, 0]
+        Y = x[:, 1]
+        self.joint.update(X, Y)
+        self.x_counts += _bin_counts(X, self.x_edges)[0]
+        self.y_counts += _bin_counts(Y, self.y_edges)[0]
+
+        self.n += len(X)
+        self.sums['x'] += X.sum()
+        self.sums['y'] += Y.sum()
+        self.sums['xx'] += (X * X).sum()
+        self.sums['yy'] += (Y * Y).sum()
+        self.sums['xy'] += (X * Y).sum()
+        self.sums['cold_well'] += np.sum(X < 0)
+        self.sums['hot_well'] += np.sum(X > 0)
+        self.sums['cold_ball'] += np.sum(np.sum((x - cold_point)**2, axis=1) < self.ball_size**2)
+        self.sums['hot_ball'] += np.sum(np.sum((x - hot_point)**2, axis=1) < self.ball_size**2)
+        return self
+
+    def merge(self, other):
+        "Add the statistics of another InvariantMeasure on the same grids."
+        if not (np.array_equal(self.x_edges, other.x_edges) and np.array_equal(self.y_edges, other.y_edges)):
+            raise ValueError('Can only merge invariant measures on the same grids.')
+        self.joint.merge(other.joint)
+        self.x_counts += other.x_counts
+        self.y_counts += other.y_counts
+        self.n += other.n
+        for k in self.sums:
+            self.sums[k] += other.sums[k]
+        return self
+
+    @property
+    def moments(self):
+        "Means, (co)variances and occupancy fractions."
+        n = max(self.n, 1)
+        m = {k: v / n for k, v in self.sums.items()}
+        return {'mean_x': m['x'], 'mean_y': m['y'],
+                'var_x': m['xx'] - m['x']**2, 'var_y': m['yy'] - m['y']**2,
+                'cov_xy': m['xy'] - m['x'] * m['y'],
+                'cold_well_fraction': m['cold_well'], 'hot_well_fraction': m['hot_well'],
+                'cold_ball_fraction': m['cold_ball'], 'hot_ball_fraction': m['hot_ball']}
+
+    def to_dataset(self):
+        """
+        Small dataset with the joint density, x and y marginal densities and
+        the moments, alongside the raw counts needed to merge later.
+        """
+        ds = self.joint.to_dataset().rename({'x': 'x_joint', 'y': 'y_joint',
+                                             'counts': 'joint_counts'})
+        ds['joint_density'] = (['x_joint', 'y_joint'], self.joint.density)
+        x = 0.5 * (self.x_edges[1:] + self.x_edges[:-1])
+        y = 0.5 * (self.y_edges[1:] + self.y_edges[:-1])
+        ds = ds.assign_coords(x=x, y=y)
+        ds['x_counts'] = ('x', self.x_counts)
+        ds['y_counts'] = ('y', self.y_counts)
+        ds['x_density'] = ('x', self.x_counts / (max(self.x_counts.sum(), 1) * np.diff(self.x_edges)))
+        ds['y_density'] = ('y', self.y_counts / (max(self.y_counts.sum(), 1) * np.diff(self.y_edges)))
+        ds['x_marginal_edges'] = ('x_marginal_edge', self.x_edges)
+        ds['y_marginal_edges'] = ('y_marginal_edge', self.y_edges)
+        for k, v in self.moments.items():
+            ds[k] = v
+        for k, v in self.sums.items():
+            ds[f'sum_{k}'] = v
+        ds.attrs = dict(self.attrs, n_points=self.n, ball_size=self.ball_size,
+                        n_outside=self.joint.n_outside)
+        return ds
+
+    def save(self, save_name):
+        self.to_dataset().to_netcdf(save_name)
+        print(f'Invariant measure saved at {save_name}')
+
+    @classmethod
+    def load(cls, file_location):
+        with xr.open_dataset(file_location) as ds:
+            ds = ds.load()
+        im = cls(ball_size=ds.attrs['ball_size'])
+        im.joint.x_edges = ds.x_edges.values
+        im.joint.y_edges = ds.y_edges.values
+        im.joint.counts = ds.joint_counts.values.astype(np.int64)
+        im.joint.n_outside = int(ds.attrs['n_outside'])
+        im.x_edges = ds.x_marginal_edges.values
+        im.y_edges = ds.y_marginal_edges.values
+        im.x_counts = ds.x_counts.values.astype(np.int64)
+        im.y_counts = ds.y_counts.values.astype(np.int64)
+        im.n = int(ds.attrs['n_points'])
+        im.sums = {k: ds[f'sum_{k}'].item() for k in im.sums}
+        im.attrs = {k: v for k, v in ds.attrs.items() if k not in ['n_points', 'ball_size', 'n_outside']}
+        return im
@@ -0,0 +1,127 @@
+"""
+Fixed grid 2D histogram of path points that can be built up a piece at a time.
+
+##########################################
+Contents
+##########################################
+
+- PathDensity class: update, merge, save/load and plot
+
+"""
+
+##########################################
+## Imports
+##########################################
+
+import numpy as np
+import xarray as xr
+import matplotlib.pyplot as plt
+
+##########################################
+## PathDensity Definition
+##########################################
+
+class PathDensity:
+    """
+    Counts of (x, y) points on a fixed grid.
+    Updated incrementally, so memory does not grow with the number of points,
+    and merged with the histograms of other workers by adding them.
+    """
+
+    def __init__(self, x_range=(-1.5, 1.5), y_range=(-1, 1), bins=100, attrs=None):
+        "Same default ranges as fancy_well_background_plot."
+        self.x_edges = np.linspace(*x_range, bins + 1)
+        self.y_edges = np.linspace(*y_range, bins + 1)
+        self.counts = np.zeros((bins, bins), dtype=np.int64)
+        self.n_outside = 0 # Points that fell off the grid
+        self.attrs = {} if attrs is None else dict(attrs)
+
+    @property
+    def bins(self):
+        return len(self.x_edges) - 1
+
+    def update(self, x, y):
+        "Add points x, y to the histogram."
+        x = np.ravel(x)
+        y = np.ravel(y)
+        bins = self.bins
+        x0, x1 = self.x_edges[0], self.x_edges[-1]
+        y0, y1 = self.y_edges[0], self.y_edges[-1]
+        inside = (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+        self.n_outside += int(np.sum(~inside))
+
+        # Grid is uniform so the bin is found directly, right edge included
+        ix = np.minimum(((x[inside] - x0) / (x1 - x0) * bins).astype(int), bins - 1)
+        iy = np.minimum(((y[inside] - y0) / (y1 - y0) * bins).astype(int), bins - 1)
+        self.counts += np.bincount(ix * bins + iy, minlength=bins * bins).reshape(bins, bins)
+        return self
+
+    def update_ds(self, ds):
+        "Add the points of a dataset with x and y variables, e.g. a transition."
+        return self.update(ds.x.values, ds.y.values)
+
+    def _check_grid(self, other):
+        if not (np.array_equal(self.x_edges, other.x_edges) and np.array_equal(self.y_edges, other.y_edges)):
+            raise ValueError('Can only merge path densities on the same grid.')
+
+    def merge(self, other):
+        "Add the counts of another PathDensity, e.g. from a parallel worker."
+        self._check_grid(other)
+        self.counts += other.counts
+        self.n_outside += other.n_outside
+        return self
+
+    def __add__(self, other):
+        self._check_grid(other)
+        total = PathDensity(attrs=self.attrs)
+        total.x_edges = self.x_edges.copy()
+        total.y_edges = self.y_edges.copy()
+        total.counts = self.counts.copy()
+        total.n_outside = self.n_outside
+        return total.merge(other)
+
+    @property
+    def total(self):
+        "Number of points on the grid."
+        return int(self.counts.sum())
+
+    @property
+    def density(self):
+        "Normalised like hist2d(..., density=True), shape (x bins, y bins)."
+        area = np.diff(self.x_edges)[:, None] * np.diff(self.y_edges)[None, :]
+        return self.counts / (max(self.total, 1) * area)
+
+    def to_dataset(self):
+        x = 0.5 * (self.x_edges[1:] + self.x_edges[:-1])
+        y = 0.5 * (self.y_edges[1:] + self.y_edges[:-1])
+        attrs = dict(self.attrs, n_outside=self.n_outside)
+        return xr.Dataset({'counts': (['x', 'y'], self.counts),
+                           'x_edges': ('x_edge', self.x_edges),
+                           'y_edges': ('y_edge', self.y_edges)},
+                          coords={'x': x, 'y': y}, attrs=attrs)
+
+    def save(self, save_name):
+        self.to_dataset().to_netcdf(save_name)
+        print(f'Path density saved at {save_name}')
+
+    @classmethod
+    def load(cls, file_location):
+        with xr.open_dataset(file_location) as ds:
+            ds = ds.load()
+        pd = cls()
+        pd.x_edges = ds.x_edges.values
+        pd.y_edges = ds.y_edges.values
+        pd.counts = ds.counts.values.astype(np.int64)
+        pd.attrs = dict(ds.attrs)
+        pd.n_outside = int(pd.attrs.pop('n_outside', 0))
+        return pd
+
+    def plot(self, fax=None, **kwargs):
+        "pcolormesh of the density, kwargs passed on, e.g. cmap."
+        if fax is None:
+            fig = plt.figure(figsize=(10, 10))
+            ax = plt.axes()
+        else:
+            fig, ax = fax
+        h = ax.pcolormesh(self.x_edges, self.y_edges, self.density.T, **kwargs)
+        return fig, ax, h
@@ -0,0 +1,210 @@
+"""
+Quasi-potential of the warped double well on an (x, y) grid.
+
+##########################################
+Contents
+##########################################
+
+- Stencil and edge costs, the geometric action of straight segments
+
+- Ordered upwind (Dijkstra) solve for U from cold_point or hot_point
+
+- Minimum action paths traced back through the solution
+
+U(x) is the least action S = 1/2 int |phi' - b(phi)|^2 dt over paths from
+the attractor to x. It is computed from the geometric action
+int |b||phi'| - b.phi' ds, so paths between grid nodes are straight lines
+along one of the stencil directions. A larger stencil radius resolves more
+directions. For this drift U = 2V - 2V(attractor) in the attractor's basin
+for every alpha, so U(saddle_point) = 0.5. Near the edges of the grid U is
+overestimated where the minimum action path would leave the grid.
+"""
+
+##########################################
+## Imports
+##########################################
+
+import heapq
+import math
+import numpy as np
+import xarray as xr
+import scipy.interpolate
+from deterministic_double_well import batch_warped_well, cold_point, hot_point
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+##########################################
+## Stencil and Edge Costs
+##########################################
+
+def stencil(radius):
+    "Grid offsets (di, dj) in a disk of radius, one per direction."
+    r = int(radius)
+    offsets = [(di, dj) for di in range(-r, r + 1) for dj in range(-r, r + 1)
+               if 0 < di**2 + dj**2 <= radius**2 and math.gcd(di, dj) == 1]
+    return np.array(offsets)
+
+def edge_costs(x, y, alpha, offsets):
+    """
+    Geometric action of the straight segment from each node along each offset,
+    by Simpson's rule. Segments leaving the grid cost inf.
+    Returns array of shape (len(offsets), len(x), len(y)).
+    """
+    X, Y = np.meshgrid(x, y, indexing='ij')
+    nodes = np.stack((X, Y), axis=-1)
+    dx, dy = x[1] - x[0], y[1] - y[0]
+    costs = np.full((len(offsets), len(x), len(y)), np.inf)
+    for k, (di, dj) in enumerate(offsets):
+        d = np.array([di * dx, dj * dy])
+        length = np.linalg.norm(d)
+        integrand = []
+        for theta in [0, 0.5, 1]:
+            b = batch_warped_well(nodes + theta * d, alpha)
+            integrand.append(np.linalg.norm(b, axis=-1) * length - b @ d)
+        cost = (integrand[0] + 4 * integrand[1] + integrand[2]) / 6
+
+        # Only keep segments ending on the grid
+        i = slice(max(0, -di), len(x) - max(0, di))
+        j = slice(max(0, -dj), len(y) - max(0, dj))
+        costs[k, i, j] = cost[i, j]
+    return costs
+
+##########################################
+## Ordered Upwind Solve
+##########################################
+
+def _dijkstra(costs, offsets, i0, j0):
+    """
+    Dijkstra from node (i0, j0). Nodes are accepted in increasing U, each one
+    updating its stencil neighbours.
+    Returns U and the offset index each node was reached along (-1 at start).
+    """
+    n_x, n_y = costs.shape[1], costs.shape[2]
+    U = np.full((n_x, n_y), np.inf)
+    parent = np.full((n_x, n_y), -1)
+    accepted = np.zeros((n_x, n_y), dtype=np.bool_)
+    U[i0, j0] = 0.
+    heap = [(0., i0, j0)]
+    while len(heap) > 0:
+        u, i, j = heapq.heappop(heap)
+        if accepted[i, j]:
+            continue
+        accepted[i, j] = True
+        for k in range(len(offsets)):
+            if costs[k, i, j] == np.inf: # Off the grid
+                continue
+            new_u = u + costs[k, i, j]
+            ni = i + offsets[k, 0]
+            nj = j + offsets[k, 1]
+            if new_u < U[ni, nj]:
+                U[ni, nj] = new_u
+                parent[ni, nj] = k
+                heapq.heappush(heap, (new_u, ni, nj))
+    return U, parent
+
+if njit is not None:
+    _dijkstra_kernel = njit(cache=True)(_dijkstra)
+else:
+    _dijkstra_kernel = _dijkstra
+
+def quasi_potential(alpha, attractor='cold', x_range=(-1.5, 1.5), y_range=(-1, 1), n_x=301, n_y=201,
+                    radius=5):
+    """
+    Quasi-potential relative to cold_point or hot_point on a grid.
+
+    --------------------
+    Arguments
+    --------------------
+    alpha, float
+        Warping parameter.
+
+    attractor, string
+        'cold' or 'hot', where U = 0.
+
+    x_range, y_range, n_x, n_y
+        Grid, the default spacing is 0.01 and has the fixed points on nodes.
+
+    radius, float
+        Stencil radius in grid points.
+
+    Returns xr.Dataset with U and the parent offsets over (x, y).
+    """
+    points = {'cold': cold_point, 'hot': hot_point}
+    if attractor not in points:
+        raise ValueError(f"attractor should be 'cold' or 'hot', not {attractor!r}")
+    x = np.linspace(*x_range, n_x)
+    y = np.linspace(*y_range, n_y)
+    offsets = stencil(radius)
+
+    # Start from the node nearest the attractor
+    i0 = int(np.argmin(np.abs(x - points[attractor][0])))
+    j0 = int(np.argmin(np.abs(y - points[attractor][1])))
+    U, parent = _dijkstra_kernel(edge_costs(x, y, alpha, offsets), offsets, i0, j0)
+
+    return xr.Dataset({'U': (['x', 'y'], U),
+                       'parent': (['x', 'y'], parent),
+                       'offsets': (['offset', 'component'], offsets)},
+                      coords={'x': x, 'y': y},
+                      attrs={'alpha': alpha, 'attractor': attractor, 'radius': radius})
+
+##########################################
+## Minimum Action Paths
+##########################################
+
+def _nearest_node(ds, point):
+    return (int(np.argmin(np.abs(ds.x.values - point[0]))),
+            int(np.argmin(np.abs(ds.y.values - point[1]))))
+
+def parent_path(ds, end_point):
+    "Grid path from the attractor to the node nearest end_point, following parents."
+    x, y = ds.x.values, ds.y.values
+    parent = ds.parent.values
+    offsets = ds.offsets.values
+    i, j = _nearest_node(ds, end_point)
+    path = [(x[i], y[j])]
+    while parent[i, j] >= 0:
+        di, dj = offsets[parent[i, j]]
+        i, j = i - di, j - dj
+        path.append((x[i], y[j]))
+    return np.array(path[::-1])
+
+def minimum_action_path(ds, end_point, step=None, max_steps=10**5):
+    """
+    Minimum action path from the attractor to end_point.
+
+    Traced back from end_point by descent along -(b + grad U), the reverse of
+    the instanton equation phi' = b + grad U. At the saddle b + grad U
+    vanishes, so the first step follows the parent pointers instead.
+    Falls back on parent_path where U is not finite.
+
+    Returns array of shape (n, 2), from the attractor to end_point.
+    """
+    x, y = ds.x.values, ds.y.values
+    h = min(x[1] - x[0], y[1] - y[0])
+    step = h / 2 if step is None else step
+    attractor = cold_point if ds.attrs['attractor'] == 'cold' else hot_point
+    U = ds.U.values
+    if not np.all(np.isfinite(U)):
+        return parent_path(ds, end_point)
+
+    gU = [scipy.interpolate.RegularGridInterpolator((x, y), g, bounds_error=False, fill_value=None)
+          for g in np.gradient(U, x, y)]
+
+    path = [np.asarray(end_point, dtype=float)]
+    grid_path = parent_path(ds, end_point)
+    if len(grid_path) > 1:
+        path.append(grid_path[-2])
+    for _ in range(max_steps):
+        p = path[-1]
+        if np.linalg.norm(p - attractor) < 2 * h:
+            break
+        direction = - (batch_warped_well(p, ds.attrs['alpha']) + np.array([g(p)[0] for g in gU]))
+        norm = np.linalg.norm(direction)
+        if norm == 0:
+            break
+        path.append(p + step * direction / norm)
+    path.append(attractor)
+    return np.array(path[::-1])
@@ -0,0 +1,147 @@
+"""
+Stochastic integration schemes for the double well and a convergence benchmark.
+
+##########################################
+Contents
+##########################################
+
+- Single step of each scheme
+
+- Integrating paths with a chosen scheme
+
+- Strong/weak convergence and speed benchmark
+
+All schemes act on arrays of shape (..., 2) so they step single paths and
+ensembles alike. The noise is additive, dX = b(X) dt + sigma dW.
+"""
+
+##########################################
+## Imports
+##########################################
+
+import time as tm
+import numpy as np
+import xarray as xr
+from deterministic_double_well import batch_warped_well, batch_warped_well_jacobian
+
+##########################################
+## Schemes
+##########################################
+
+def em_scheme(x, dt, dW, alpha, sigma):
+    "Euler-Maruyama."
+    return x + batch_warped_well(x, alpha) * dt + sigma * dW
+
+def milstein_scheme(x, dt, dW, alpha, sigma):
+    """
+    Milstein. With additive noise the correction term vanishes, so this is
+    Euler-Maruyama, which then has strong order 1.
+    """
+    return em_scheme(x, dt, dW, alpha, sigma)
+
+def heun_scheme(x, dt, dW, alpha, sigma):
+    "Stochastic Heun, an EM predictor followed by a trapezoidal drift corrector."
+    b = batch_warped_well(x, alpha)
+    x_predict = x + b * dt + sigma * dW
+    return x + 0.5 * (b + batch_warped_well(x_predict, alpha)) * dt + sigma * dW
+
+def _implicit_drift_solve(rhs, dt, alpha, newton_steps=4):
+    "Solves y - b(y) dt = rhs with Newton's method, started from rhs."
+    y = rhs.copy()
+    for _ in range(newton_steps):
+        F = y - batch_warped_well(y, alpha) * dt - rhs
+        J = np.eye(2) - dt * batch_warped_well_jacobian(y, alpha)
+        y = y - np.linalg.solve(J, F[..., None])[..., 0]
+    return y
+
+def implicit_scheme(x, dt, dW, alpha, sigma):
+    "Drift-implicit (backward) Euler, y = x + b(y) dt + sigma dW."
+    return _implicit_drift_solve(x + sigma * dW, dt, alpha)
+
+def split_step_scheme(x, dt, dW, alpha, sigma):
+    "Split-step backward Euler, an implicit drift step then the noise."
+    return _implicit_drift_solve(x, dt, alpha) + sigma * dW
+
+SCHEMES = {
+    'em': em_scheme,
+    'milstein': milstein_scheme,
+    'heun': heun_scheme,
+    'implicit': implicit_scheme,
+    'split_step': split_step_scheme,
+}
+
+def get_scheme(scheme):
+    if scheme not in SCHEMES:
+        raise ValueError(f'scheme should be one of {list(SCHEMES)}, not {scheme!r}')
+    return SCHEMES[scheme]
+
+##########################################
+## Integrating Paths
+##########################################
+
+def sde_path(x0, t, p, scheme='em', rng=None, dW=None):
+    """
+    Integrates from x0 over times t with the chosen scheme.
+    x0 has shape (2,) or (n_realisations, 2).
+    dW, optional Brownian increments of shape (len(t) - 1, *x0.shape),
+    otherwise drawn from rng.
+    Returns array of shape (len(t), *x0.shape).
+    """
+    alpha, sigma = p
+    step = get_scheme(scheme)
+    x0 = np.asarray(x0, dtype=float)
+    dts = np.diff(t)
+    if dW is None:
+        rng = np.random.default_rng() if rng is None else rng
+        dW = np.sqrt(dts).reshape(-1, *[1] * x0.ndim) * rng.standard_normal((len(dts), *x0.shape))
+    x = np.zeros((len(t), *x0.shape))
+    x[0] = x0
+    for i, dt in enumerate(dts):
+        x[i+1] = step(x[i], dt, dW[i], alpha, sigma)
+    return x
+
+##########################################
+## Convergence Benchmark
+##########################################
+
+def convergence_benchmark(p, x0=(-1, 0), T=10., dts=(0.4, 0.2, 0.1, 0.05), fine_dt=0.001,
+                          schemes=tuple(SCHEMES), n_paths=1000, seed=None):
+    """
+    Compares schemes against a fine-dt reference driven by the same noise.
+
+    The reference is Heun at fine_dt. Coarse increments are sums of the fine
+    ones, so the paths can be compared directly at time T.
+
+    Returns xr.Dataset over (scheme, dt) of
+    strong_error, mean |X(T) - X_ref(T)|,
+    weak_error, |E[x(T)] - E[x_ref(T)]| for the x coordinate,
+    steps_per_second, realisation steps per second of wall clock.
+    """
+    rng = np.random.default_rng(seed)
+    n_fine = int(round(T / fine_dt))
+    x0 = np.tile(np.asarray(x0, dtype=float), (n_paths, 1))
+    dW_fine = np.sqrt(fine_dt) * rng.standard_normal((n_fine, n_paths, 2))
+    reference = sde_path(x0, fine_dt * np.arange(n_fine + 1), p, 'heun', dW=dW_fine)[-1]
+
+    strong = np.zeros((len(schemes), len(dts)))
+    weak = np.zeros((len(schemes), len(dts)))
+    speed = np.zeros((len(schemes), len(dts)))
+    for j, dt in enumerate(dts):
+        ratio = int(round(dt / fine_dt))
+        n = n_fine // ratio
+        dW = dW_fine[:n * ratio].reshape(n, ratio, n_paths, 2).sum(axis=1)
+        t = dt * np.arange(n + 1)
+        for i, scheme in enumerate(schemes):
+            start = tm.time()
+            x_T = sde_path(x0, t, p, scheme, dW=dW)[-1]
+            speed[i, j] = n * n_paths / (tm.time() - start)
+            strong[i, j] = np.mean(np.linalg.norm(x_T - reference, axis=-1))
+            weak[i, j] = np.abs(x_T[:, 0].mean() - reference[:, 0].mean())
+
+    coords = {'scheme': list(schemes), 'dt': list(dts)}
+    dims = ['scheme', 'dt']
+    alpha, sigma = p
+    return xr.Dataset({'strong_error': (dims, strong),
+                       'weak_error': (dims, weak),
+                       'steps_per_second': (dims, speed)},
+                      coords=coords, attrs={'alpha': alpha, 'sigma': sigma, 'T': T, 'fine_dt': fine_dt})
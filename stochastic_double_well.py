@@ -1,37 +1,497 @@
 """
 Contains EM scheme for solving integrating stochastic double well.
 """
-from deterministic_double_well import warped_well, hot_point, cold_point
+import os
+import sys
+import pickle
+from pathlib import Path
+from deterministic_double_well import warped_well, batch_warped_well, hot_point, cold_point
+from sde_schemes import get_scheme
+from invariant_measure import InvariantMeasure
 import numpy as np
 import numpy.random as rm
+import xarray as xr
 from tqdm.notebook import tqdm
 from joblib import Parallel, delayed
 
-def double_well_em(x0, t, p, timer=False):
+sys.path.append(str(Path(__file__).resolve().parent / 'Finding-Transitions')) # Transition files
+
+try:
+    from numba import njit
+except ImportError: # Fall back to the blocked NumPy kernel
+    njit = None
+
+def double_well_em(x0, t, p, timer=False, rng=None, block=10**5, scheme='em'):
+    """
+    rng, optional np.random.Generator the noise is drawn from, otherwise
+    the global numpy.random state. Noise is drawn block steps at a time.
+    scheme, 'em' or any other scheme in sde_schemes.SCHEMES.
+    """
     alpha, sigma = p
+    step = None if scheme == 'em' else get_scheme(scheme)
     N = len(t)
     x = np.zeros(np.append(N, x0.shape))
     x[0] = x0
+    normal = rm.standard_normal if rng is None else rng.standard_normal
     for i in tqdm(range(N-1), disable=not timer):
+        if i % block == 0:
+            noise = normal((min(block, N - 1 - i), 2))
         dt = t[i+1]-t[i]
-        dWt = rm.normal(0, np.sqrt(dt), 2)
-        x[i+1] = x[i] + warped_well(x[i], alpha) * dt + sigma * dWt
+        dWt = np.sqrt(dt) * noise[i % block]
+        if step is None:
+            x[i+1] = x[i] + warped_well(x[i], alpha) * dt + sigma * dWt
+        else:
+            x[i+1] = step(x[i], dt, dWt, alpha, sigma)
+    return x
+
+def spawn_generators(n, seed=None):
+    "n independent Generators spawned from one SeedSequence."
+    return [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(n)]
+
+##########################################
+## Compiled EM kernel
+##########################################
+
+def _fused_em(x, dts, noise, alpha, sigma):
+    """
+    Fills x in place, drift written out in closed form.
+    noise, standard normal draws of shape (len(dts), 2).
+    """
+    for i in range(len(dts)):
+        dt = dts[i]
+        sdt = sigma * np.sqrt(dt)
+        X = x[i, 0]
+        Y = x[i, 1]
+        gx = X * (X * X - 1.)
+        gy = 2. * Y
+        x[i+1, 0] = X + (alpha * gy - gx) * dt + sdt * noise[i, 0]
+        x[i+1, 1] = Y - (alpha * gx + gy) * dt + sdt * noise[i, 1]
+    return x
+
+def _fill_normal(noise):
+    "Fills noise in place with standard normal draws from the kernel's generator."
+    for i in range(noise.shape[0]):
+        for j in range(noise.shape[1]):
+            noise[i, j] = np.random.normal()
+    return noise
+
+def _fill_normal_numpy(noise):
+    noise[:] = rm.standard_normal(noise.shape)
+    return noise
+
+def _seed_fused_em(seed):
+    np.random.seed(seed)
+
+if njit is not None:
+    _em_kernel = njit(cache=True)(_fused_em)
+    _normal_kernel = njit(cache=True)(_fill_normal)
+    _seed_kernel = njit(cache=True)(_seed_fused_em)
+else: # Same loop, run by the interpreter
+    _em_kernel = _fused_em
+    _normal_kernel = _fill_normal_numpy
+    _seed_kernel = rm.seed
+
+def _seed_kernel_fresh(seed=None):
+    """
+    Seeds the kernel's generator, from fresh OS entropy if seed is None.
+    Forked workers inherit the parent's generator state, so without this
+    their unseeded runs would all draw the same noise.
+    """
+    if seed is None:
+        seed = int(np.random.SeedSequence().generate_state(1)[0])
+    _seed_kernel(seed)
+
+def _em_blocks(x, dts, alpha, sigma, block=10**5):
+    "Runs _em_kernel over x a block at a time, noise drawn into one reused buffer."
+    noise = np.empty((min(block, len(dts)), 2))
+    for start in range(0, len(dts), block):
+        n = min(block, len(dts) - start)
+        _normal_kernel(noise[:n])
+        _em_kernel(x[start:start + n + 1], dts[start:start + n], noise[:n], alpha, sigma)
     return x
 
-def em_step(x0, dt, p):
+def double_well_em_fast(x0, t, p, seed=None):
+    """
+    Same as double_well_em but runs in a single compiled loop.
+    Uses numba when available, otherwise the same loop uncompiled.
+    Returns array of shape (len(t), 2).
+    seed, optional int seeding the kernel's random number generator,
+    fresh entropy if None.
+    """
+    alpha, sigma = p
+    _seed_kernel_fresh(seed)
+    x = np.zeros((len(t), 2))
+    x[0] = x0
+    dts = np.diff(np.asarray(t, dtype=float))
+    return _em_blocks(x, dts, float(alpha), float(sigma))
+
+##########################################
+## Streaming Integration
+##########################################
+
+def double_well_em_chunks(x0, T, dt, p, chunk_size=10**6, t0=0., seed=None, rng=None, start=0):
+    """
+    Streaming version of double_well_em_fast.
+    Integrates on the grid np.arange(t0, t0 + T, dt) but only ever holds
+    chunk_size points, yielding (time, x) chunks with x of shape (n, 2).
+
+    rng, optional np.random.Generator. If given the noise is drawn from it
+    a chunk at a time, so the run can be reproduced from its saved state.
+    start, index of the first point to produce. When resuming, x0 is the
+    point at index start - 1.
+    """
+    alpha, sigma = float(p[0]), float(p[1])
+    if rng is None:
+        _seed_kernel_fresh(seed)
+    N = int(np.ceil(T / dt))
+    dts = np.full(chunk_size, float(dt))
+    buf = np.zeros((chunk_size + 1, 2))
+    buf[0] = x0
+
+    def step(x):
+        if rng is None:
+            _em_blocks(x, dts[:len(x)-1], alpha, sigma)
+        else:
+            _em_kernel(x, dts[:len(x)-1], rng.standard_normal((len(x)-1, 2)), alpha, sigma)
+
+    while start < N:
+        n = min(chunk_size, N - start)
+        if start == 0: # First point is the initial condition itself
+            step(buf[:n])
+            chunk = buf[:n].copy()
+        else:
+            step(buf[:n+1])
+            chunk = buf[1:n+1].copy()
+        time = t0 + dt * np.arange(start, start + n)
+        buf[0] = chunk[-1]
+        start += n
+        yield time, chunk
+
+class ChunkedTrajectoryWriter:
+    """
+    Appends trajectory chunks to a netCDF file with an unlimited time dimension.
+    The file opens with xr.open_dataset as a dataset with x and y over time,
+    and alpha and sigma, or whatever is in attrs, as attributes.
+    """
+
+    def __init__(self, save_name, attrs=None, chunk_size=10**6, start=None):
+        """
+        save_name: netcdf file to write, attrs: global attributes, e.g. alpha & sigma.
+        start: reopen an existing file and carry on writing from this index,
+        anything already written past it is overwritten.
+        """
+        import netCDF4
+        self.save_name = save_name
+        if start is not None:
+            self.ds = netCDF4.Dataset(save_name, 'a')
+            self._time = self.ds['time']
+            self._x = self.ds['x']
+            self._y = self.ds['y']
+            self.length = start
+            return
+        self.ds = netCDF4.Dataset(save_name, 'w')
+        self.ds.createDimension('time', None)
+        chunks = (min(chunk_size, 2**20),)
+        self._time = self.ds.createVariable('time', 'f8', ('time',), chunksizes=chunks)
+        self._x = self.ds.createVariable('x', 'f8', ('time',), chunksizes=chunks)
+        self._y = self.ds.createVariable('y', 'f8', ('time',), chunksizes=chunks)
+        if attrs is not None:
+            self.ds.setncatts(attrs)
+            for v in [self._x, self._y]:
+                v.setncatts(attrs)
+        self.length = 0
+
+    def write(self, time, x):
+        "Append a chunk, x has shape (len(time), 2)."
+        stop = self.length + len(time)
+        self._time[self.length:stop] = time
+        self._x[self.length:stop] = x[:, 0]
+        self._y[self.length:stop] = x[:, 1]
+        self.length = stop
+
+    def sync(self):
+        "Flush what has been written to disk."
+        self.ds.sync()
+
+    def close(self):
+        self.ds.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def save_em_stream(x0, T, dt, p, save_name, chunk_size=10**6, seed=None, checkpoint=None, measure=None):
+    """
+    Integrate and write to save_name in chunks, memory use is set by chunk_size.
+    checkpoint: file where the run state is saved after every chunk. If it
+    already exists the run resumes from it, giving the same output bit for bit
+    as an uninterrupted run. Removed once the integration finishes.
+    measure: optional InvariantMeasure updated with every chunk, returned.
+    """
+    alpha, sigma = p
+    attrs = {'alpha': alpha, 'sigma': sigma}
+    if checkpoint is None:
+        with ChunkedTrajectoryWriter(save_name, attrs, chunk_size) as writer:
+            for time, x in double_well_em_chunks(x0, T, dt, p, chunk_size, seed=seed):
+                writer.write(time, x)
+                if measure is not None:
+                    measure.update(x)
+        print(f'Saved at {save_name}\n')
+        return measure
+
+    rng = np.random.default_rng(seed)
+    start = None
+    if os.path.exists(checkpoint):
+        state = load_checkpoint(checkpoint)
+        x0, start = state['x'], state['step']
+        rng.bit_generator.state = state['rng_state']
+        measure = state.get('measure', measure)
+        print(f'Resuming {save_name} from step {start}\n')
+
+    with ChunkedTrajectoryWriter(save_name, attrs, chunk_size, start=start) as writer:
+        chunks = double_well_em_chunks(x0, T, dt, p, chunk_size, rng=rng, start=start or 0)
+        for time, x in chunks:
+            writer.write(time, x)
+            if measure is not None:
+                measure.update(x)
+            writer.sync() # Output on disk before the checkpoint that refers to it
+            save_checkpoint(checkpoint, {'x': x[-1], 'step': writer.length,
+                                         'rng_state': rng.bit_generator.state,
+                                         'measure': measure})
+    os.remove(checkpoint)
+    print(f'Saved at {save_name}\n')
+    return measure
+
+def double_well_em_statistics(x0, T, dt, p, chunk_size=10**6, seed=None, measure=None, ball_size=0.1):
+    """
+    Integrates without keeping the trajectory, only its InvariantMeasure.
+    Returns the measure's small dataset of histograms, moments and well
+    occupancy fractions.
+    """
+    alpha, sigma = p
+    if measure is None:
+        measure = InvariantMeasure(ball_size=ball_size, attrs={'alpha': alpha, 'sigma': sigma})
+    for time, x in double_well_em_chunks(x0, T, dt, p, chunk_size, seed=seed):
+        measure.update(x)
+    return measure.to_dataset()
+
+def save_checkpoint(checkpoint, state):
+    "Pickle run state, replacing the old checkpoint only once the new one is written."
+    with open(checkpoint + '.tmp', 'wb') as handle:
+        pickle.dump(state, handle)
+    os.replace(checkpoint + '.tmp', checkpoint)
+
+def load_checkpoint(checkpoint):
+    with open(checkpoint, 'rb') as handle:
+        return pickle.load(handle)
+
+##########################################
+## Online Transition Detection
+##########################################
+
+def symbolic_chunk(x, ball_size=0.1):
+    "Tags points with -1 near cold_point, 1 near hot_point and 0 elsewhere."
+    cold = np.sum((x - cold_point)**2, axis=-1) < ball_size**2
+    hot = np.sum((x - hot_point)**2, axis=-1) < ball_size**2
+    return hot.astype(int) - cold.astype(int)
+
+def _transition_ds(time, x, p):
+    alpha, sigma = p
+    direction = 'c2h' if x[0, 0] < x[-1, 0] else 'h2c'
+    attrs = {'alpha': alpha, 'sigma': sigma, 'direction': direction,
+             'start_time': time[0], 'end_time': time[-1]}
+    x_data = xr.DataArray(x[:, 0], coords={'time': time}, dims=['time'], name='x')
+    y_data = xr.DataArray(x[:, 1], coords={'time': time}, dims=['time'], name='y')
+    return xr.Dataset({'x': x_data, 'y': y_data}, attrs=attrs)
+
+def double_well_em_transitions(x0, T, dt, p, ball_size=0.1, chunk_size=10**6, seed=None, measure=None):
+    """
+    Integrates like double_well_em_chunks but only keeps the current excursion.
+    Yields each completed cold->hot or hot->cold transition as an xr.Dataset,
+    the same form as Finding-Transitions' get_transitions, with the direction
+    and start/end times in its attrs.
+    measure: optional InvariantMeasure updated with every chunk.
+    """
+    last_symbol = 0 # Ball we were last in, 0 if none yet
+    buffer = [] # (time, x) pieces since we last left a ball
+
+    for time, x in double_well_em_chunks(x0, T, dt, p, chunk_size, seed=seed):
+        if measure is not None:
+            measure.update(x)
+        symbols = symbolic_chunk(x, ball_size)
+        tagged = np.flatnonzero(symbols)
+
+        if len(tagged) == 0:
+            if last_symbol != 0:
+                buffer.append((time, x))
+            continue
+
+        # Transitions end wherever the tagged ball differs from the previous one
+        values = symbols[tagged]
+        previous = np.append(last_symbol, values[:-1])
+        for j in np.flatnonzero((values != previous) & (previous != 0)):
+            end = tagged[j] + 1
+            if j == 0:
+                pieces = buffer + [(time[:end], x[:end])]
+            else:
+                pieces = [(time[tagged[j-1]:end], x[tagged[j-1]:end])]
+            yield _transition_ds(np.concatenate([t for t, _ in pieces]),
+                                 np.concatenate([y for _, y in pieces]), p)
+
+        last_symbol = values[-1]
+        buffer = [(time[tagged[-1]:], x[tagged[-1]:])]
+
+def save_em_transitions(x0, T, dt, p, save_dir, ball_size=0.1, chunk_size=10**6, prefix='', seed=None,
+                        densities=None, measure=None, source_file=''):
+    """
+    Integrate and save only the transitions.
+    Written to save_dir as {prefix}cold-to-hot.nc and {prefix}hot-to-cold.nc
+    with save_transition_store, plus {prefix}catalogue.nc, the layout
+    Finding-Transitions/main.py writes. Per integration files are merged
+    with consolidate_transitions.
+    densities, optional {'c2h': PathDensity, 'h2c': PathDensity} updated
+    with every transition and saved as {prefix}cold-to-hot-density.nc etc.
+    measure, optional InvariantMeasure updated with the whole trajectory.
+    """
+    from utilities import save_transition_store, save_transition_catalogue, catalogue_from_times
+    alpha, sigma = p
+    if not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+    names = {'c2h': 'cold-to-hot', 'h2c': 'hot-to-cold'}
+    transitions = {'c2h': [], 'h2c': []}
+    directions, start_times, end_times = [], [], []
+    for ds in double_well_em_transitions(x0, T, dt, p, ball_size, chunk_size, seed, measure):
+        direction = ds.attrs['direction']
+        transitions[direction].append(ds)
+        directions.append(direction)
+        start_times.append(ds.attrs['start_time'])
+        end_times.append(ds.attrs['end_time'])
+        if densities is not None:
+            densities[direction].update_ds(ds)
+
+    attrs = {'alpha': alpha, 'sigma': sigma, 'ball_size': ball_size}
+    for direction, name in names.items():
+        save_transition_store(transitions[direction], save_dir + prefix + name + '.nc',
+                              [source_file] * len(transitions[direction]), attrs)
+        if densities is not None:
+            densities[direction].save(save_dir + prefix + name + '-density.nc')
+    catalogue = catalogue_from_times(alpha, sigma, directions, start_times, end_times, 0., source_file)
+    save_transition_catalogue([catalogue], save_dir + prefix + 'catalogue.nc')
+    return {direction: len(t) for direction, t in transitions.items()}
+
+##########################################
+## First Passage Times
+##########################################
+
+def first_passage_times(p, n_transitions, n_walkers=1000, dt=0.1, target='x>0',
+                        ball_size=0.1, seed=None, max_steps=None, timer=False):
+    """
+    Samples hitting times of a target set for walkers started at cold_point.
+
+    All n_walkers are stepped together and each one restarts from cold_point
+    as soon as it hits the target. Once n_transitions hits are recorded no new
+    walkers are started, but the ones in flight are run until they hit. This
+    way long excursions are not censored, so the sample is unbiased and may
+    contain a few more than n_transitions times.
+
+    target, 'x>0' or 'hot_ball' (within ball_size of hot_point).
+    max_steps, optional cap on the number of steps taken.
+    Returns array of hitting times.
+    """
+    alpha, sigma = p
+    if target not in ['x>0', 'hot_ball']:
+        raise ValueError(f"target should be 'x>0' or 'hot_ball', not {target!r}")
+    rng = np.random.default_rng(seed)
+    x = np.tile(cold_point, (n_walkers, 1)).astype(float)
+    steps = np.zeros(n_walkers, dtype=int) # Steps since each walker started
+    active = np.ones(n_walkers, dtype=bool)
+    block = max(1, 10**6 // n_walkers) # Steps of noise held at once
+    hitting_times = []
+    restarting = True
+
+    pbar = tqdm(total=n_transitions, disable=not timer)
+    step = 0
+    while active.any() and (max_steps is None or step < max_steps):
+        if step % block == 0:
+            noise = rng.standard_normal((block, n_walkers, 2))
+        x += batch_warped_well(x, alpha) * dt + sigma * np.sqrt(dt) * noise[step % block]
+        steps += 1
+        step += 1
+
+        if target == 'x>0':
+            hit = x[:, 0] > 0
+        elif target == 'hot_ball':
+            hit = np.sum((x - hot_point)**2, axis=1) < ball_size**2
+        hit &= active
+        if not hit.any():
+            continue
+
+        hitting_times.extend(dt * steps[hit])
+        pbar.update(hit.sum())
+        x[hit] = cold_point
+        steps[hit] = 0
+        if restarting and len(hitting_times) >= n_transitions:
+            restarting = False
+        if not restarting:
+            active[hit] = False
+    pbar.close()
+    return np.array(hitting_times)
+
+def em_step(x0, dt, p, scheme='em'):
     alpha, sigma = p
     dWt = rm.normal(0, np.sqrt(dt), 2)
-    x1 = x0 + warped_well(x0, p) * dt + sigma * dWt
+    x1 = get_scheme(scheme)(x0, dt, dWt, alpha, sigma)
     return x1
 
-def double_well_ensemble_simulation(ic_list, time, p, multiprocess=True):
+def double_well_ensemble_em(ics, t, p, timer=False, seed=None, rngs=None, scheme='em'):
+    """
+    EM scheme stepping a whole ensemble at once.
+    ics has shape (n_realisations, 2), e.g. from cold_ic_spread/hot_ic_spread.
+    Each realisation draws its noise from its own Generator, either given as
+    rngs or spawned from seed, so realisation i matches
+    double_well_em(ics[i], t, p, rng=rngs[i]).
+    scheme, any scheme in sde_schemes.SCHEMES.
+    Returns array of shape (len(t), n_realisations, 2).
+    """
+    alpha, sigma = p
+    step = get_scheme(scheme)
+    ics = np.asarray(ics, dtype=float)
+    if rngs is None:
+        rngs = spawn_generators(len(ics), seed)
+    N = len(t)
+    block = max(1, 10**6 // len(ics)) # Steps of noise held at once
+    x = np.zeros(np.append(N, ics.shape))
+    x[0] = ics
+    for i in tqdm(range(N-1), disable=not timer):
+        if i % block == 0:
+            b = min(block, N - 1 - i)
+            noise = np.stack([rng.standard_normal((b, 2)) for rng in rngs], axis=1)
+        dt = t[i+1]-t[i]
+        dWt = np.sqrt(dt) * noise[i % block]
+        x[i+1] = step(x[i], dt, dWt, alpha, sigma)
+    return x
+
+def double_well_ensemble_simulation(ic_list, time, p, multiprocess=True, batched=False, seed=None):
+    """
+    Runs double_well_em for each initial condition.
+    Every realisation gets its own Generator spawned from seed, so results
+    are reproducible and the same whichever way the ensemble is run.
+    """
     results = []
+    rngs = spawn_generators(len(ic_list), seed)
+
+    if batched:
+        # One array step for all realisations, returned in the usual list form
+        return list(np.swapaxes(double_well_ensemble_em(ic_list, time, p, rngs=rngs), 0, 1))
 
     if multiprocess:
-        results = Parallel(n_jobs = -2)(delayed(double_well_em)(ic, time, p) for ic in tqdm(ic_list))
+        results = Parallel(n_jobs = -2)(delayed(double_well_em)(ic, time, p, rng=rng)
+                                        for ic, rng in zip(tqdm(ic_list), rngs))
     else:
-        for ic in tqdm(ic_list):
-            results.append(double_well_em(ic, time, p))
+        for ic, rng in zip(tqdm(ic_list), rngs):
+            results.append(double_well_em(ic, time, p, rng=rng))
     return results
 
 def ic_spread(x, n):
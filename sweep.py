@@ -0,0 +1,123 @@
+"""
+Runs experiments over (alpha, sigma) grids on a local process pool.
+
+##########################################
+Contents
+##########################################
+
+- Building the (alpha, sigma) grid
+
+- Cost model used to balance the work
+
+- Sweep runner with resume
+
+"""
+
+##########################################
+## Imports
+##########################################
+
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+##########################################
+## Parameter Grid
+##########################################
+
+def alpha_sigma_pairs(alphas, sigmas):
+    "List (a, s) pairs for lists of alphas and sigmas."
+    alpha_sigma_pairs = []
+    for alpha in alphas:
+        for sigma in sigmas:
+            alpha_sigma_pairs.append((alpha, sigma))
+    return alpha_sigma_pairs
+
+def array_job_pair(pairs, argv):
+    "Pick the pair for a PBS array index, as the scripts do with sys.argv[1]."
+    return pairs[int(argv[1]) - 1]
+
+##########################################
+## Cost Model
+##########################################
+
+def kramers_cost(alpha, sigma, barrier=0.25):
+    """
+    Relative cost of a case, taken as the Kramers waiting time exp(2 dV / sigma^2).
+    dV = 0.25 is the barrier between the wells and the saddle.
+    Rotation does not change the quasi-potential so alpha is ignored.
+    """
+    return np.exp(2 * barrier / sigma**2)
+
+##########################################
+## Completion Markers
+##########################################
+
+def _marker(directory):
+    return os.path.join(directory, '.complete')
+
+def mark_complete(directory):
+    "Leave a marker in directory saying the case finished."
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    open(_marker(directory), 'w').close()
+
+def is_marked_complete(directory):
+    return os.path.exists(_marker(directory))
+
+##########################################
+## Sweep Runner
+##########################################
+
+def run_sweep(case, pairs, is_complete=None, cost=kramers_cost, n_workers=None):
+    """
+    Runs case(alpha, sigma) for every pair on a process pool.
+
+    --------------------
+    Arguments
+    --------------------
+    case, function
+        Takes (alpha, sigma). Must be defined at the top level of a module
+        so it can be sent to the worker processes.
+
+    pairs, list
+        (alpha, sigma) pairs, e.g. from alpha_sigma_pairs.
+
+    is_complete, function
+        Takes (alpha, sigma), returns True if the case is already done.
+        Completed cases are skipped so an interrupted sweep can resume.
+
+    cost, function
+        Takes (alpha, sigma), returns the relative cost of a case.
+        Cases are handed out most expensive first, which keeps all workers
+        busy until the end of the sweep.
+
+    n_workers, int
+        Size of the pool, defaults to the number of cores.
+
+    Returns dictionary of {(alpha, sigma): result}.
+    """
+    if is_complete is not None:
+        skipped = [p for p in pairs if is_complete(*p)]
+        for p in skipped:
+            print(f'Skipping alpha = {p[0]}, sigma = {p[1]}, already complete.')
+        pairs = [p for p in pairs if p not in skipped]
+
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    pairs = sorted(pairs, key=lambda p: cost(*p), reverse=True)
+    print(f'Running {len(pairs)} cases on {n_workers} workers.\n')
+
+    results = {}
+    # Workers reseed numpy.random from fresh entropy rather than share the parent's state
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=np.random.seed) as pool:
+        futures = {pool.submit(case, *p): p for p in pairs}
+        for future in as_completed(futures):
+            p = futures[future]
+            try:
+                results[p] = future.result()
+                print(f'Finished alpha = {p[0]}, sigma = {p[1]}.')
+            except Exception as e: # Keep the rest of the sweep going
+                results[p] = e
+                print(f'Failed alpha = {p[0]}, sigma = {p[1]}: {e!r}')
+    return results